@@ -0,0 +1,352 @@
+"""Offline stand-in for the subset of PRAW used by the bot.
+
+It replays a trace of comments (recorded or synthetic, one JSON object per line) through
+`subreddit(...).stream.comments()` or the `subreddit(...).comments()` listings and answers `parent()`, `reply()`,
+`reddit.info(...)`, the context requests of the ancestry service and the inbox from memory. Every call which
+would hit reddit is counted and may be slowed down by a fixed latency. Replies posted too quickly raise the
+same RATELIMIT APIException as reddit.
+"""
+import collections
+import json
+import random
+import threading
+import time
+from praw.exceptions import APIException
+
+BOT_NAME = "mc_bc_bot"
+
+
+class FakeRedditor:
+    def __init__(self, name):
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+
+class FakeSubreddit:
+    def __init__(self, reddit, display_name):
+        self._reddit = reddit
+        self.display_name = display_name
+        self.stream = FakeStream(reddit, display_name)
+
+    def new(self, limit=None):
+        """Yields the submissions of the subreddit, the newest first, one request per page of 100"""
+        names = {name.lower() for name in self.display_name.split("+")}
+        submissions = [thing for thing in self._reddit.things.values()
+                       if isinstance(thing, FakeSubmission) and thing.subreddit.display_name.lower() in names]
+        for index, submission in enumerate(sorted(submissions, key=lambda thing: -thing.created_utc)[:limit]):
+            if index % 100 == 0:
+                self._reddit._call("listing")
+            yield submission
+
+    def comments(self, limit=100, params=None):
+        """Returns the newest comments of the subreddit which arrived, the newest first, in one request.
+        The page ends at the `before` comment of the params, or starts after their `after` comment"""
+        params = params or {}
+        return self._reddit.listing({name.lower() for name in self.display_name.split("+")}, limit,
+                                    params.get("before"), params.get("after"))
+
+
+class FakeStream:
+    def __init__(self, reddit, display_name):
+        self.reddit = reddit
+        self.subreddits = {name.lower() for name in display_name.split("+")}
+
+    def comments(self, **kwargs):
+        """Yields the comments of the trace which belong to the subreddits, paced at the rate of the reddit"""
+        return self.reddit.replay(self.subreddits)
+
+
+class FakeSubmission:
+    def __init__(self, reddit, id, author, subreddit, created_utc=0.0):
+        self._reddit = reddit
+        self.id = id
+        self.fullname = "t3_" + id
+        self.author = FakeRedditor(author) if author else None
+        self.subreddit = reddit.subreddit(subreddit)
+        self.created_utc = created_utc
+        self._replies = []
+        self._comments = None
+
+    @property
+    def comments(self):
+        if self._comments is None:
+            self._reddit._call("comments")
+            self._comments = FakeCommentForest(self._reddit, self._replies)
+        return self._comments
+
+    def __repr__(self):
+        return f"FakeSubmission({self.id})"
+
+
+class FakeComment:
+    def __init__(self, reddit, id, body, author, parent_id, link_id, subreddit, created_utc):
+        self._reddit = reddit
+        self.id = id
+        self.fullname = "t1_" + id
+        self.body = body
+        self.author = FakeRedditor(author) if author else None
+        self.parent_id = parent_id
+        self.link_id = link_id
+        self.subreddit = reddit.subreddit(subreddit)
+        self.created_utc = created_utc
+        self.permalink = f"/r/{subreddit}/comments/{link_id[3:]}/_/{id}/"
+        self._replies = []
+        self.streamed_at = None
+
+    @property
+    def replies(self):
+        return self._replies
+
+    def parent(self):
+        return self._reddit.fetch(self.parent_id)
+
+    def reply(self, body):
+        return self._reddit.post_reply(self, body)
+
+    def __repr__(self):
+        return f"FakeComment({self.id})"
+
+
+class FakeCommentForest:
+    """The comments of a submission. The forest is complete, every 100 comments below the first 200
+    need one more request to be expanded, as they would be behind MoreComments on reddit"""
+    def __init__(self, reddit, top_level):
+        self._reddit = reddit
+        self.top_level = top_level
+
+    def replace_more(self, limit=32):
+        hidden = max(0, len(self.list()) - 200)
+        for _ in range(min(limit, -(-hidden // 100))):
+            self._reddit._call("morechildren")
+        return []
+
+    def list(self):
+        comments, queue = [], list(self.top_level)
+        while queue:
+            comment = queue.pop(0)
+            comments.append(comment)
+            queue.extend(comment._replies)
+        return comments
+
+
+class FakeListing:
+    def __init__(self, children):
+        self.children = children
+
+
+class FakeAuth:
+    def __init__(self):
+        self.limits = {"remaining": None, "reset_timestamp": None, "used": None}
+
+
+class FakeConfig:
+    def __init__(self, username):
+        self.username = username
+
+
+class FakeInbox:
+    """An inbox holding the private messages given to the FakeReddit"""
+    def __init__(self, reddit):
+        self.reddit = reddit
+        self.messages = []
+
+    def unread(self, limit=None):
+        self.reddit._call("inbox")
+        return [message for message in self.messages if message.new]
+
+    def mark_read(self, items):
+        self.reddit._call("inbox")
+        for item in items:
+            item.new = False
+
+
+class FakeMessage:
+    def __init__(self, id, author, subject, body):
+        self.id = id
+        self.author = FakeRedditor(author) if author else None
+        self.subject = subject
+        self.body = body
+        self.was_comment = False
+        self.new = True
+
+
+class FakeReddit:
+    """Replays a trace of comments without any network access
+
+    :param trace: list of dicts with the keys id, body, author, parent_id, link_id, subreddit, created_utc.
+        The submissions are described by dicts whose id starts with t3_
+    :param rate: number of comments per second streamed, None to stream as fast as they are consumed
+    :param latency: number of seconds every API call takes
+    :param reply_interval: minimum number of seconds between two replies, RATELIMIT is raised otherwise
+    """
+    def __init__(self, trace, rate=None, latency=0.0, reply_interval=0.0, bot_name=BOT_NAME):
+        self.rate = rate
+        self.latency = latency
+        self.reply_interval = reply_interval
+        self.bot_name = bot_name
+        self.config = FakeConfig(bot_name)
+        self.auth = FakeAuth()
+        self.inbox = FakeInbox(self)
+        self.api_calls = collections.Counter()
+        self.lock = threading.Lock()
+        self.things = {}
+        self.stream_order = []
+        self.replies = []
+        self.last_reply_at = None
+        self.reply_count = 0
+        self.subreddits = {}
+        self.started_at = None
+        for item in trace:
+            self._add(item)
+
+    def _add(self, item):
+        if item["id"].startswith("t3_"):
+            thing = FakeSubmission(self, item["id"][3:], item.get("author"), item["subreddit"],
+                                   item.get("created_utc", 0.0))
+        else:
+            thing = FakeComment(self, item["id"], item["body"], item.get("author"), item["parent_id"],
+                                item["link_id"], item["subreddit"], item.get("created_utc", time.time()))
+            self.stream_order.append(thing)
+            parent = self.things.get(thing.parent_id)
+            if parent is not None:
+                parent._replies.append(thing)
+        self.things[thing.fullname] = thing
+
+    def _call(self, endpoint):
+        with self.lock:
+            self.api_calls[endpoint] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def subreddit(self, display_name):
+        subreddit = self.subreddits.get(display_name)
+        if subreddit is None:
+            subreddit = self.subreddits[display_name] = FakeSubreddit(self, display_name)
+        return subreddit
+
+    def replay(self, subreddits):
+        """Yields the comments of the trace, one request per page of 100 comments"""
+        interval = 1 / self.rate if self.rate else 0
+        for index, comment in enumerate(self.stream_order):
+            if comment.subreddit.display_name.lower() not in subreddits:
+                continue
+            if index % 100 == 0:
+                self._call("stream")
+            if interval:
+                time.sleep(interval)
+            comment.streamed_at = time.perf_counter()
+            yield comment
+
+    def arrived(self):
+        """Returns the number of comments of the trace which arrived, `rate` of them per second since the first
+        listing. They all arrived if there is no rate"""
+        if self.rate is None:
+            return len(self.stream_order)
+        if self.started_at is None:
+            self.started_at = time.perf_counter()
+        return min(len(self.stream_order), int((time.perf_counter() - self.started_at) * self.rate))
+
+    def listing(self, subreddits, limit, before=None, after=None):
+        self._call("listing")
+        comments = []
+        for comment in reversed(self.stream_order[:self.arrived()]):
+            if after is not None:
+                if comment.fullname == after:
+                    after = None
+                continue
+            if len(comments) >= limit or (before is not None and comment.fullname == before):
+                break
+            if comment.subreddit.display_name.lower() in subreddits:
+                if comment.streamed_at is None:
+                    comment.streamed_at = time.perf_counter()
+                comments.append(comment)
+        return comments
+
+    def submission(self, id):
+        return self.things["t3_" + id]
+
+    def fetch(self, fullname):
+        self._call("parent")
+        return self.things[fullname]
+
+    def info(self, fullnames):
+        self._call("info")
+        return (self.things[fullname] for fullname in fullnames if fullname in self.things)
+
+    def get(self, path, params=None):
+        """Answers the context request of a comment: the comment with its parents and the submission"""
+        self._call("context")
+        link_id, comment_id = path.rstrip("/").split("/")[1::2]
+        depth = (params or {}).get("context", 0)
+        chain = [self.things["t1_" + comment_id]]
+        while len(chain) <= depth and chain[-1].parent_id.startswith("t1_"):
+            chain.append(self.things[chain[-1].parent_id])
+        top = chain[-1]
+        return [FakeListing([self.things["t3_" + link_id]]), FakeListing([_ContextNode(top, chain)])]
+
+    def post_reply(self, comment, body):
+        self._call("reply")
+        with self.lock:
+            now = time.monotonic()
+            if self.last_reply_at is not None and now - self.last_reply_at < self.reply_interval:
+                wait = max(1, int(self.reply_interval - (now - self.last_reply_at) + 0.5))
+                raise APIException(["RATELIMIT",
+                                    f"Looks like you've been doing that a lot. "
+                                    f"Take a break for {wait} seconds before trying again.",
+                                    "ratelimit"])
+            self.last_reply_at = now
+            self.reply_count += 1
+            reply = FakeComment(self, f"r{self.reply_count}", body, self.bot_name, comment.fullname,
+                                comment.link_id, comment.subreddit.display_name, time.time())
+            self.things[reply.fullname] = reply
+            comment._replies.append(reply)
+            self.replies.append((comment, reply, time.perf_counter()))
+        return reply
+
+
+class _ContextNode:
+    """A comment of a context response, whose only reply is the next comment towards the requested one"""
+    def __init__(self, comment, chain):
+        self._comment = comment
+        index = chain.index(comment)
+        self._replies = [_ContextNode(chain[index - 1], chain)] if index > 0 else []
+
+    def __getattr__(self, name):
+        return getattr(self._comment, name)
+
+
+def load_trace(path):
+    """Reads a trace from a JSON lines file"""
+    with open(path, "r") as trace_file:
+        return [json.loads(line) for line in trace_file if line.strip()]
+
+
+def synthetic_trace(comment_count=10000, thread_count=50, subreddits=("Cricket", "CricketShitpost"),
+                    trigger_ratio=0.05, bot_ratio=0.01, seed=42):
+    """Generates the submissions and comments of busy threads.
+    A comment replies to its submission or to any earlier comment of the same thread,
+    so the threads get deep. Some of the comments are made by the bot itself"""
+    rng = random.Random(seed)
+    trace = []
+    threads = []
+    for index in range(thread_count):
+        submission = {"id": f"t3_s{index}", "author": f"op{index}", "subreddit": rng.choice(subreddits),
+                      "created_utc": 1.0 + index}
+        trace.append(submission)
+        threads.append((submission, []))
+    words = ["bowled", "edge", "slip", "cover", "drive", "sledge", "umpire", "review", "howzat", "declare"]
+    for index in range(comment_count):
+        submission, comments = rng.choice(threads)
+        parent = submission["id"] if not comments or rng.random() < 0.2 else rng.choice(comments)["fullname"]
+        body = " ".join(rng.choice(words) for _ in range(rng.randint(5, 40)))
+        if rng.random() < trigger_ratio:
+            body += " mc bc"
+        comment = {"id": f"c{index}", "body": body,
+                   "author": BOT_NAME if rng.random() < bot_ratio else f"user{rng.randrange(1000)}",
+                   "parent_id": parent, "link_id": submission["id"], "subreddit": submission["subreddit"],
+                   "created_utc": 1.0 + index}
+        trace.append(comment)
+        comments.append(dict(comment, fullname="t1_" + comment["id"]))
+    return trace
@@ -0,0 +1,77 @@
+"""Compares PRAW's stream of the combined subreddits with the AdaptivePoller against the offline FakeReddit.
+
+The comments arrive at a fixed rate, most of them in a busy subreddit and a few in quiet ones. Reports the
+requests made and the delay between the arrival of a comment and its detection, per subreddit.
+
+Run with: python -m project_dir.mc_bc_bot.benchmarks.polling [--duration 30]
+"""
+import argparse
+import collections
+import threading
+from praw.models.util import stream_generator
+from project_dir.mc_bc_bot.benchmarks.fake_reddit import FakeReddit, synthetic_trace
+from project_dir.mc_bc_bot.benchmarks.throughput import percentiles
+from project_dir.mc_bc_bot.core.poller import AdaptivePoller
+
+# Share of the threads of every subreddit in the synthetic trace
+SUBREDDIT_WEIGHTS = {"Cricket": 18, "CricketShitpost": 2, "testingground4bots": 1}
+
+
+def run(comments_factory, trace, rate, latency, duration):
+    """Reads the comments for `duration` seconds and returns the measurements as a dict"""
+    reddit = FakeReddit(trace, rate=rate, latency=latency)
+    arrival = {comment.fullname: index / rate for index, comment in enumerate(reddit.stream_order)}
+    delays = collections.defaultdict(list)
+    stopped = threading.Event()
+
+    def read():
+        for comment in comments_factory(reddit):
+            if stopped.is_set():
+                return
+            if comment is not None:
+                delays[comment.subreddit.display_name].append(
+                    comment.streamed_at - reddit.started_at - arrival[comment.fullname])
+
+    # The reader may be sleeping between two polls when the time is up, it is left behind
+    threading.Thread(target=read, daemon=True).start()
+    stopped.wait(duration)
+    stopped.set()
+    delays = {subreddit: list(values) for subreddit, values in delays.items()}
+    return {"requests": reddit.api_calls["listing"], "detected": sum(len(values) for values in delays.values()),
+            "arrived": reddit.arrived(),
+            "delays": {subreddit: percentiles(values) for subreddit, values in sorted(delays.items())}}
+
+
+def praw_stream(reddit):
+    return stream_generator(reddit.subreddit("+".join(SUBREDDIT_WEIGHTS)).comments)
+
+
+def adaptive_poller(budget):
+    return lambda reddit: AdaptivePoller(reddit, list(SUBREDDIT_WEIGHTS), budget).comments()
+
+
+def report(name, result):
+    print(f"--- {name}")
+    print(f"requests           {result['requests']}")
+    print(f"comments           {result['detected']} detected out of {result['arrived']}")
+    for subreddit, delays in result["delays"].items():
+        print(f"{subreddit:<18} " + " ".join(f"p{point}={value:.1f}s" for point, value in delays.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the polling of the subreddits")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds during which each reader runs")
+    parser.add_argument("--rate", type=float, default=5.0, help="Comments per second in all the subreddits")
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds taken by every API call")
+    parser.add_argument("--budget", type=float, default=30.0, help="Requests per minute of the AdaptivePoller")
+    arguments = parser.parse_args()
+
+    subreddits = tuple(name for name, weight in SUBREDDIT_WEIGHTS.items() for _ in range(weight))
+    trace = synthetic_trace(int(arguments.rate * arguments.duration * 2), subreddits=subreddits)
+    report("PRAW stream", run(praw_stream, trace, arguments.rate, arguments.latency, arguments.duration))
+    report("AdaptivePoller", run(adaptive_poller(arguments.budget / 60), trace, arguments.rate, arguments.latency,
+                                 arguments.duration))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""End-to-end throughput benchmark of the RedditAdapter pipeline against the offline FakeReddit.
+
+Reports the comments processed per second, the latency percentiles from the stream to the end of
+the processing of every comment and to the posting of every reply, and the API calls per reply.
+
+Run with: python -m project_dir.mc_bc_bot.benchmarks.throughput [--trace comments.jsonl]
+"""
+import argparse
+import asyncio
+import time
+from project_dir.mc_bc_bot.benchmarks.fake_reddit import FakeReddit, load_trace, synthetic_trace
+from project_dir.mc_bc_bot.core.pipeline import Pipeline
+from project_dir.mc_bc_bot.core.reddit import RedditAdapter
+from project_dir.mc_bc_bot.core.scheduler import TokenBucket
+from project_dir.mc_bc_bot.core.store import BotStore
+
+
+class TimingAdapter(RedditAdapter):
+    """Records when each comment was done with, i.e. when it was seen by the pipeline"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.done_at = {}
+
+    def mark_seen(self, message):
+        self.done_at[message.native.fullname] = time.perf_counter()
+        super().mark_seen(message)
+
+    def comment_stream(self):
+        # The FakeReddit replays the whole trace on its stream, which ends with it
+        return self.subreddits.stream.comments()
+
+    def caught_up(self, comments):
+        # The replay already starts with the first comment of the trace, nothing was missed before it
+        return comments
+
+
+def percentiles(values, points=(50, 90, 99)):
+    values = sorted(values)
+    if not values:
+        return {point: float("nan") for point in points}
+    return {point: values[min(len(values) - 1, int(len(values) * point / 100))] for point in points}
+
+
+def run(trace, consumers=4, rate=None, latency=0.0, reply_interval=0.0, reply_rate=1000.0):
+    """Replays the trace and returns the measurements as a dict"""
+    reddit = FakeReddit(trace, rate=rate, latency=latency, reply_interval=reply_interval)
+    subreddits = "+".join(sorted({item["subreddit"] for item in trace}))
+    store = BotStore(":memory:")
+    started = time.perf_counter()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    adapter = TimingAdapter(reddit.subreddit(subreddits), store, started_at=0.0,
+                            bucket=TokenBucket(rate=reply_rate, capacity=reply_rate))
+    loop.run_until_complete(Pipeline([adapter], store, consumers).run())
+    loop.close()
+    elapsed = time.perf_counter() - started
+
+    comments = {comment.fullname: comment for comment in reddit.stream_order}
+    processing = [done_at - comments[fullname].streamed_at for fullname, done_at in adapter.done_at.items()]
+    replying = [posted_at - comment.streamed_at for comment, reply, posted_at in reddit.replies]
+    calls = sum(reddit.api_calls.values()) - reddit.api_calls["stream"]
+    return {
+        "comments": len(processing),
+        "elapsed": elapsed,
+        "comments_per_second": len(processing) / elapsed,
+        "processing_latency": percentiles(processing),
+        "replies": len(reddit.replies),
+        "reply_latency": percentiles(replying),
+        "api_calls": dict(reddit.api_calls),
+        "api_calls_per_reply": calls / len(reddit.replies) if reddit.replies else float("nan"),
+    }
+
+
+def report(result):
+    print(f"comments           {result['comments']} in {result['elapsed']:.2f} s "
+          f"({result['comments_per_second']:.0f}/s)")
+    for name in ("processing_latency", "reply_latency"):
+        latency = " ".join(f"p{point}={value * 1000:.1f}ms" for point, value in result[name].items())
+        print(f"{name:<18} {latency}")
+    print(f"replies            {result['replies']}")
+    print(f"api calls          {result['api_calls']} ({result['api_calls_per_reply']:.2f} per reply)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline throughput benchmark of the reddit pipeline")
+    parser.add_argument("--trace", help="JSON lines trace to replay instead of a synthetic one")
+    parser.add_argument("--comments", type=int, default=5000, help="Number of comments of the synthetic trace")
+    parser.add_argument("--consumers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--rate", type=float, help="Comments per second streamed, unlimited by default")
+    parser.add_argument("--latency", type=float, default=0.005, help="Seconds taken by every API call")
+    parser.add_argument("--reply-interval", type=float, default=0.0,
+                        help="Minimum seconds between two replies before RATELIMIT is raised")
+    arguments = parser.parse_args()
+
+    trace = load_trace(arguments.trace) if arguments.trace else synthetic_trace(arguments.comments)
+    for consumers in arguments.consumers:
+        print(f"--- {consumers} consumers")
+        report(run(trace, consumers=consumers, rate=arguments.rate, latency=arguments.latency,
+                   reply_interval=arguments.reply_interval))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Micro-benchmark of the compiled trigger matcher against the linear `any(...)` scan.
+
+Run with: python -m project_dir.mc_bc_bot.benchmarks.trigger_matching
+"""
+import random
+import string
+import timeit
+from project_dir.mc_bc_bot.core.triggers import TriggerMatcher
+
+TRIGGER_COUNTS = (10, 100, 1000)
+COMMENT_COUNT = 1000
+
+
+def random_word(rng, low=4, high=10):
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(low, high)))
+
+
+def synthetic_comments(rng, triggers, count=COMMENT_COUNT, hit_ratio=0.01):
+    """Returns comments of ~40 words out of which `hit_ratio` contain a trigger"""
+    comments = []
+    for _ in range(count):
+        words = [random_word(rng, 2, 8) for _ in range(40)]
+        if rng.random() < hit_ratio:
+            words[rng.randrange(len(words))] = rng.choice(triggers)
+        comments.append(" ".join(words).capitalize())
+    return comments
+
+
+def linear_scan(triggers, body):
+    """The previous implementation of is_trigger_comment"""
+    return any(ele in body.lower() for ele in triggers)
+
+
+def run(trigger_counts=TRIGGER_COUNTS, repeat=5):
+    rng = random.Random(42)
+    print(f"{'triggers':>8} {'any(...) us':>12} {'matcher us':>12} {'speedup':>8}")
+    for trigger_count in trigger_counts:
+        triggers = ["mc bc", "mcbc"] + [random_word(rng) for _ in range(trigger_count - 2)]
+        comments = synthetic_comments(rng, triggers)
+        matcher = TriggerMatcher(triggers)
+        assert [matcher.matches(c) for c in comments] == [linear_scan(triggers, c) for c in comments]
+
+        linear = min(timeit.repeat(lambda: [linear_scan(triggers, c) for c in comments], number=1, repeat=repeat))
+        compiled = min(timeit.repeat(lambda: [matcher.matches(c) for c in comments], number=1, repeat=repeat))
+        per_linear = linear / len(comments) * 1e6
+        per_compiled = compiled / len(comments) * 1e6
+        print(f"{trigger_count:>8} {per_linear:>12.2f} {per_compiled:>12.2f} {per_linear / per_compiled:>7.1f}x")
+
+
+if __name__ == "__main__":
+    run()
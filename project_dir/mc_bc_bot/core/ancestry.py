@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import cachetools
+from praw.const import API_PATH
+from praw.models import MoreComments
+from project_dir.mc_bc_bot.utils.general_utilities import run_blocking
+
+# Name of the account when the reddit object does not tell it
+BOT_NAME = "mc_bc_bot"
+# Reddit returns at most this many parents of a comment when asked for its context
+CONTEXT_DEPTH = 8
+# Reddit accepts at most this many fullnames per /api/info request
+INFO_BATCH_SIZE = 100
+
+logger = logging.getLogger(__name__)
+
+
+def get_account_name(reddit):
+    """Returns the name of the account the reddit object is authenticated with: the username of its praw.ini
+    section, or the one reddit returns for it. BOT_NAME if neither is known"""
+    config = getattr(reddit, "config", None)
+    if getattr(config, "username", None):
+        return config.username
+    try:
+        me = reddit.user.me()
+    except Exception:
+        logger.exception("Could not tell the name of the account, %s is assumed", BOT_NAME)
+        return BOT_NAME
+    return me.name if me is not None else BOT_NAME
+
+
+def _author_name(thing):
+    """Returns the name of the author of the comment/submission, None if it was deleted"""
+    author = thing.author
+    return author.name if author is not None else None
+
+
+class InfoBatcher:
+    """Collects the fullnames requested concurrently and fetches them with a single /api/info request
+
+    :param reddit: the authenticated reddit object
+    :param window: number of seconds to wait for other requests before fetching
+    """
+    def __init__(self, reddit, window=0.05):
+        self.reddit = reddit
+        self.window = window
+        self.pending = {}
+        self.flush_handle = None
+        self.requests = 0
+
+    async def fetch(self, fullname):
+        """Returns the comment/submission with the fullname, None if reddit does not know it"""
+        future = self.pending.get(fullname)
+        if future is None:
+            loop = asyncio.get_event_loop()
+            future = self.pending[fullname] = loop.create_future()
+            if len(self.pending) >= INFO_BATCH_SIZE:
+                self._flush()
+            elif self.flush_handle is None:
+                self.flush_handle = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        batch, self.pending = self.pending, {}
+        asyncio.ensure_future(self._fetch_batch(batch))
+
+    async def _fetch_batch(self, batch):
+        self.requests += 1
+        try:
+            things = await run_blocking(lambda: list(self.reddit.info(fullnames=list(batch))))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        found = {thing.fullname: thing for thing in things}
+        for fullname, future in batch.items():
+            if not future.done():
+                future.set_result(found.get(fullname))
+
+
+class ThreadAncestry:
+    """Answers whether the bot already commented in the chain of parents of a comment.
+
+    The verdict of every node of a walked chain is cached, so the siblings and children in the same
+    thread are answered without any request. Missing chains are fetched through the context of the
+    comment which returns up to CONTEXT_DEPTH parents and the submission in a single request.
+    Single nodes are fetched through /api/info, batched with the other concurrent validations.
+
+    :param reddit: the authenticated reddit object
+    :param bot_name: name of the account of the bot, the one of the reddit object by default
+    :param maxsize: maximum number of cached nodes and verdicts
+    :param ttl: number of seconds for which a verdict is cached
+    """
+    def __init__(self, reddit, bot_name=None, maxsize=10000, ttl=3600):
+        self.reddit = reddit
+        self.bot_name = bot_name if bot_name is not None else get_account_name(reddit)
+        # fullname -> True if the bot commented in the chain ending with this node
+        self.verdicts = cachetools.TTLCache(maxsize=maxsize, ttl=ttl)
+        # fullname -> (author name, parent fullname or None for a submission)
+        self.nodes = cachetools.LRUCache(maxsize=maxsize)
+        self.info_batcher = InfoBatcher(reddit)
+        self.context_requests = 0
+
+    def is_bot(self, author):
+        """Returns True if the author is the account of the bot. Reddit names are case-insensitive"""
+        return author is not None and author.lower() == self.bot_name.lower()
+
+    @property
+    def requests(self):
+        """Number of requests made to reddit"""
+        return self.context_requests + self.info_batcher.requests
+
+    def record(self, thing):
+        """Remembers the author and parent of a comment/submission which was already fetched"""
+        parent = thing.parent_id if thing.fullname.startswith("t1_") else None
+        self.nodes[thing.fullname] = (_author_name(thing), parent)
+
+    def record_bot_reply(self, reply):
+        """Marks the reply of the bot so that nothing below it is replied to again"""
+        self.nodes[reply.fullname] = (self.bot_name, reply.parent_id)
+        self.verdicts[reply.fullname] = True
+
+    async def _fetch_context(self, link_id, fullname):
+        """Fetches the comment with up to CONTEXT_DEPTH of its parents and the submission"""
+        path = API_PATH["submission"].format(id=link_id.split("_", 1)[1]) + "_/" + fullname.split("_", 1)[1]
+        self.context_requests += 1
+        submission_listing, comment_listing = await run_blocking(
+            self.reddit.get, path, {"context": CONTEXT_DEPTH})
+        for submission in submission_listing.children:
+            self.record(submission)
+        queue = list(comment_listing.children)
+        while queue:
+            thing = queue.pop()
+            if not isinstance(thing, MoreComments):
+                self.record(thing)
+                queue.extend(thing._replies)
+
+    async def _node(self, link_id, fullname):
+        node = self.nodes.get(fullname)
+        if node is not None:
+            return node
+        if fullname.startswith("t1_"):
+            await self._fetch_context(link_id, fullname)
+            node = self.nodes.get(fullname)
+            if node is not None:
+                return node
+        thing = await self.info_batcher.fetch(fullname)
+        if thing is None:
+            # Removed from reddit, the chain cannot be followed any further
+            return None, None
+        self.record(thing)
+        return self.nodes[fullname]
+
+    async def bot_in_chain(self, comment):
+        """Returns True if the bot authored any of the parents of the comment or its submission"""
+        walked = []
+        fullname = comment.parent_id
+        verdict = False
+        while fullname is not None:
+            cached = self.verdicts.get(fullname)
+            if cached is not None:
+                verdict = cached
+                break
+            walked.append(fullname)
+            author, fullname = await self._node(comment.link_id, walked[-1])
+            if self.is_bot(author):
+                verdict = True
+                break
+        for node in walked:
+            self.verdicts[node] = verdict
+        return verdict
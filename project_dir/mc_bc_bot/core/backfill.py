@@ -0,0 +1,145 @@
+import asyncio
+import json
+import logging
+import time
+from praw.models import MoreComments
+from project_dir.mc_bc_bot.utils.general_utilities import run_blocking
+from project_dir.mc_bc_bot.core.ancestry import ThreadAncestry, get_account_name
+from project_dir.mc_bc_bot.core.pipeline import Adapter
+from project_dir.mc_bc_bot.core.reddit import to_message
+from project_dir.mc_bc_bot.core.scheduler import ReplyScheduler, TokenBucket
+
+# Number of MoreComments expanded per submission, each of them costs a request
+REPLACE_MORE_LIMIT = 32
+# Number of submissions expanded concurrently
+BACKFILL_CONCURRENCY = 4
+# Number of comments remembered by the ancestry of the backfill, the forests are walked without any request
+BACKFILL_ANCESTRY_SIZE = 200000
+# Replies per second when only writing the plan
+PLAN_RATE = 1000.0
+
+logger = logging.getLogger(__name__)
+
+
+class BackfillAdapter(Adapter):
+    """Scans the comment forests of past submissions: those of the subreddits posted in a time window,
+    or the given ones. The forests are expanded concurrently with a bounded replace_more budget and their
+    comments go through the same pipeline as the live stream.
+    The submissions done with are recorded in the store so that an interrupted backfill resumes where it stopped.
+
+    :param reddit: the authenticated reddit object
+    :param store: the BotStore of the pipeline
+    :param subreddits: names of the subreddits whose submissions are scanned
+    :param since: UNIX timestamp of the oldest submission scanned
+    :param until: UNIX timestamp of the newest submission scanned, now if None
+    :param submission_ids: ids of the submissions to scan instead of those of the time window
+    :param replace_more: number of MoreComments expanded per submission
+    :param concurrency: number of submissions expanded concurrently
+    :param plan: file in which the replies are written as JSON lines instead of being posted
+    """
+    platform = "reddit"
+
+    def __init__(self, reddit, store, subreddits=(), since=None, until=None, submission_ids=(),
+                 replace_more=REPLACE_MORE_LIMIT, concurrency=BACKFILL_CONCURRENCY, plan=None, bucket=None,
+                 ancestry=None):
+        if plan is not None:
+            bucket = bucket or TokenBucket(rate=PLAN_RATE, capacity=PLAN_RATE)
+        super().__init__(bucket)
+        self.reddit = reddit
+        self.store = store
+        self.subreddits = list(subreddits)
+        self.since = since
+        self.until = until
+        self.submission_ids = list(submission_ids)
+        self.replace_more = replace_more
+        self.concurrency = concurrency
+        self.plan = plan
+        self.ancestry = ancestry or ThreadAncestry(reddit, bot_name=get_account_name(reddit),
+                                                   maxsize=BACKFILL_ANCESTRY_SIZE)
+        # link_id -> number of its comments which are still in the pipeline
+        self.outstanding = {}
+        self.progress_prefix = "plan:" if plan is not None else ""
+
+    def find_submissions(self, subreddit):
+        """Returns the submissions of the subreddit posted in the time window. Blocking, runs in the executor"""
+        until = self.until or time.time()
+        submissions = []
+        for submission in self.reddit.subreddit(subreddit).new(limit=None):
+            if submission.created_utc < self.since:
+                break
+            if submission.created_utc <= until:
+                submissions.append(submission)
+        logger.info("Found %s submissions of %s to backfill", len(submissions), subreddit)
+        return submissions
+
+    def expand(self, submission):
+        """Returns the comments of the submission after expanding its forest. Blocking, runs in the executor"""
+        submission.comments.replace_more(limit=self.replace_more)
+        return [comment for comment in submission.comments.list() if not isinstance(comment, MoreComments)]
+
+    async def backfill_submission(self, submission, queue, semaphore):
+        progress_key = self.progress_prefix + submission.id
+        if self.store.is_backfilled(progress_key):
+            return
+        async with semaphore:
+            comments = await run_blocking(self.expand, submission)
+        logger.info("Backfilling %s comments of %s", len(comments), submission.id)
+        # Recorded from the loop thread, the caches of the ancestry are not thread safe
+        self.ancestry.record(submission)
+        for comment in comments:
+            self.ancestry.record(comment)
+        if not comments:
+            self.store.mark_backfilled(progress_key)
+            return
+        self.outstanding[submission.fullname] = len(comments)
+        for comment in comments:
+            await queue.put(to_message(self, comment))
+
+    async def produce(self, queue):
+        if self.submission_ids:
+            submissions = [self.reddit.submission(id=submission_id) for submission_id in self.submission_ids]
+        else:
+            found = await asyncio.gather(*(run_blocking(self.find_submissions, subreddit)
+                                           for subreddit in self.subreddits))
+            submissions = [submission for subreddit_submissions in found for submission in subreddit_submissions]
+        semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(*(self.backfill_submission(submission, queue, semaphore)
+                               for submission in submissions))
+
+    def is_new(self, message):
+        return not self.store.is_processed(message.id)
+
+    def mark_seen(self, message):
+        """Called once the reply to the comment was posted or planned, or when none was due.
+        The submission is recorded as backfilled after its last comment, so that a resume scans again
+        the submissions whose replies were still queued"""
+        self.outstanding[message.thread] -= 1
+        if self.outstanding[message.thread] == 0:
+            del self.outstanding[message.thread]
+            self.store.mark_backfilled(self.progress_prefix + message.thread.split("_", 1)[1])
+
+    async def is_valid(self, message):
+        """The comment must not be replied to by the bot yet, nor be below a comment of the bot.
+        The forest was recorded in the ancestry, so the parents are known without any request"""
+        if self.ancestry.is_bot(message.author):
+            return False
+        for reply in message.native.replies:
+            if not isinstance(reply, MoreComments) and reply.author is not None and \
+                    self.ancestry.is_bot(reply.author.name):
+                return False
+        return not await self.ancestry.bot_in_chain(message.native)
+
+    def make_scheduler(self, post, queue=None, on_done=None):
+        return ReplyScheduler(post, reddit=None if self.plan is not None else self.reddit, bucket=self.bucket,
+                              queue=queue, on_done=on_done)
+
+    async def reply(self, message, body):
+        if self.plan is None:
+            return await run_blocking(message.native.reply, body)
+        self.plan.write(json.dumps({"comment": message.native.fullname, "author": message.author,
+                                    "permalink": message.native.permalink, "body": body}) + "\n")
+        self.plan.flush()
+        return None
+
+    def replied(self, message, reply):
+        self.ancestry.record_bot_reply(reply)
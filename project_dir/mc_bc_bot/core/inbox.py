@@ -0,0 +1,79 @@
+import asyncio
+import logging
+from project_dir.mc_bc_bot.utils.general_utilities import run_blocking
+from project_dir.mc_bc_bot.core.metrics import INBOX_COMMANDS
+
+# Number of seconds between two reads of the inbox
+INBOX_POLL_INTERVAL = 60.0
+# Subjects (or bodies) of the private messages which opt the author out of or back into the replies.
+# The opt-out link of the footer of the replies prefills "Excludeme"
+OPT_OUT_COMMANDS = frozenset(["excludeme", "exclude me", "opt-out", "optout"])
+OPT_IN_COMMANDS = frozenset(["includeme", "include me", "opt-in", "optin"])
+
+logger = logging.getLogger(__name__)
+
+
+def parse_command(message):
+    """Returns "exclude" or "include" for the opt-out and opt-in messages, None for any other message"""
+    for text in (message.subject, message.body):
+        text = (text or "").strip().lower()
+        if text in OPT_OUT_COMMANDS:
+            return "exclude"
+        if text in OPT_IN_COMMANDS:
+            return "include"
+    return None
+
+
+class InboxPoller:
+    """Reads the unread private messages of the bot and applies the opt-out and opt-in requests to the store.
+    The commands are marked as read together, the other messages are left unread for the owner of the account.
+    The exclusions written by the other workers sharing the store are reloaded by its flusher
+
+    :param reddit: the praw.Reddit object of the account
+    :param store: the BotStore keeping the excluded authors
+    :param interval: number of seconds between two polls
+    """
+    def __init__(self, reddit, store, interval=INBOX_POLL_INTERVAL):
+        self.reddit = reddit
+        self.store = store
+        self.interval = interval
+        # Ids of the unread messages already parsed, only those still unread are kept
+        self.seen = set()
+
+    def read_commands(self):
+        """Returns the unread messages with their command. Blocking, runs in the executor"""
+        commands = []
+        unread = set()
+        for message in self.reddit.inbox.unread(limit=None):
+            unread.add(message.id)
+            if getattr(message, "was_comment", False) or message.id in self.seen or message.author is None:
+                continue
+            command = parse_command(message)
+            if command is not None:
+                commands.append((message, command))
+        self.seen = unread
+        return commands
+
+    async def poll(self):
+        """Applies the pending commands and returns their number"""
+        commands = await run_blocking(self.read_commands)
+        for message, command in commands:
+            author = message.author.name
+            if command == "exclude":
+                self.store.exclude(author)
+            else:
+                self.store.include(author)
+            INBOX_COMMANDS.inc()
+            logger.info("%s asked to be %sd", author, command)
+        if commands:
+            await run_blocking(self.reddit.inbox.mark_read, [message for message, _ in commands])
+        return len(commands)
+
+    async def run(self):
+        """Polls the inbox every `interval` seconds until it is cancelled. Failed polls are retried at the next one"""
+        while True:
+            try:
+                await self.poll()
+            except Exception:
+                logger.exception("Failed to read the inbox")
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,112 @@
+"""A platform made of local files or TCP connections, to try the bot without any account.
+
+Every input line is a message: either plain text, or a JSON object with the keys of `Message`
+(id, body, author, channel, thread, created_at), the missing ones getting defaults. created_at is an ISO date
+or a UNIX timestamp, the lines with any other created_at are skipped. The replies are written as
+JSON lines {"in_reply_to": id, "body": reply}, in the output file or back on the connection.
+
+    $ echo '{"body": "mc bc", "author": "someone"}' | nc localhost 8765
+"""
+import argparse
+import itertools
+import json
+import logging
+import sys
+import time
+import asyncio
+from project_dir.mc_bc_bot.utils.general_utilities import run_blocking, parse_timestamp
+from project_dir.mc_bc_bot.core.pipeline import Adapter, Message
+from project_dir.mc_bc_bot.core.scheduler import TokenBucket
+
+# Replies per second, nothing limits them locally
+LOCAL_REPLY_RATE = 1000.0
+
+logger = logging.getLogger(__name__)
+
+
+class LocalAdapter(Adapter):
+    """Reads the messages from a file (or standard input) or serves them on a TCP port
+
+    :param path: JSON lines file of messages, "-" for the standard input
+    :param port: TCP port on which the messages are received, used when there is no path
+    :param host: address the TCP server listens on
+    :param output: file receiving the replies to the messages of the file, the standard output by default
+    """
+    platform = "local"
+    # The ids are given by the sender or numbered from 0 at every start, they must not reach the shared store
+    keeps_processed = False
+
+    def __init__(self, path=None, port=None, host="127.0.0.1", output=None, bucket=None):
+        super().__init__(bucket or TokenBucket(rate=LOCAL_REPLY_RATE, capacity=LOCAL_REPLY_RATE))
+        if path is None and port is None:
+            raise ValueError("The local adapter needs a path or a port")
+        self.path = path
+        self.port = port
+        self.host = host
+        self.output = output or sys.stdout
+        self.sequence = itertools.count()
+
+    def parse(self, line, sink):
+        """Returns the message of the line, None for a blank or malformed line"""
+        line = line.strip()
+        if not line:
+            return None
+        try:
+            fields = json.loads(line) if line.startswith("{") else {"body": line}
+        except ValueError:
+            logger.warning("Ignored the malformed line %r", line)
+            return None
+        created_at = fields.get("created_at")
+        if created_at is None:
+            created_at = time.time()
+        else:
+            try:
+                created_at = parse_timestamp(str(created_at))
+            except (argparse.ArgumentTypeError, ValueError):
+                logger.warning("Ignored the line %r, its created_at is no date or timestamp", line)
+                return None
+        message_id = f"local:{fields.get('id', next(self.sequence))}"
+        return Message(self, message_id, fields.get("body", ""), fields.get("author", "local"),
+                       fields.get("channel"), fields.get("thread", message_id), created_at, sink)
+
+    def read_file(self):
+        if self.path == "-":
+            return sys.stdin.readlines()
+        with open(self.path, "r", encoding="utf-8") as messages_file:
+            return messages_file.readlines()
+
+    async def produce(self, queue):
+        if self.path is not None:
+            for line in await run_blocking(self.read_file):
+                message = self.parse(line, self.output)
+                if message is not None:
+                    await queue.put(message)
+            return
+        server = await asyncio.start_server(lambda reader, writer: self.serve(reader, writer, queue),
+                                            self.host, self.port)
+        logger.info("Receiving the messages on %s:%s", self.host, self.port)
+        # The server serves until it is closed, python 3.6 has neither serve_forever nor its context manager
+        try:
+            await server.wait_closed()
+        finally:
+            server.close()
+
+    async def serve(self, reader, writer, queue):
+        """Queues the messages of a connection, the replies are written back on it"""
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            message = self.parse(line.decode("utf-8", errors="replace"), writer)
+            if message is not None:
+                await queue.put(message)
+
+    async def reply(self, message, body):
+        line = json.dumps({"in_reply_to": message.id, "body": body}) + "\n"
+        if isinstance(message.native, asyncio.StreamWriter):
+            message.native.write(line.encode("utf-8"))
+            await message.native.drain()
+        else:
+            message.native.write(line)
+            message.native.flush()
+        return body
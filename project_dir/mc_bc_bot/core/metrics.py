@@ -0,0 +1,193 @@
+import asyncio
+import bisect
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+# Upper bounds in seconds of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Number of seconds between two dumps of the metrics in the JSON file
+DUMP_INTERVAL = 60.0
+# Counter of the dropped comments, labelled by queue and reason by each SheddingQueue
+COMMENTS_SHED = "mc_bc_bot_comments_shed_total"
+COMMENTS_SHED_DESCRIPTION = "Comments dropped by a full queue or because they were too old to be answered"
+
+logger = logging.getLogger(__name__)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in sorted(labels.items())) + "}"
+
+
+class Counter:
+    def __init__(self, name, labels=None):
+        self.name = name
+        self.labels = labels or {}
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self):
+        yield self.name, self.labels, self.value
+
+
+class Gauge:
+    """A value read from a function when the metrics are collected, e.g. the size of a queue"""
+    def __init__(self, name, function, labels=None):
+        self.name = name
+        self.function = function
+        self.labels = labels or {}
+
+    def samples(self):
+        yield self.name, self.labels, self.function()
+
+
+class Histogram:
+    """Counts the observations in cumulative buckets like a Prometheus histogram"""
+    def __init__(self, name, labels=None, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.labels = labels or {}
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    @contextlib.contextmanager
+    def time(self):
+        """Observes the number of seconds spent in the with block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            yield self.name + "_bucket", dict(self.labels, le="+Inf" if bound == float("inf") else repr(bound)), \
+                cumulative
+        yield self.name + "_sum", self.labels, self.sum
+        yield self.name + "_count", self.labels, self.count
+
+
+class MetricsRegistry:
+    """Holds the metrics of the bot and renders them in the Prometheus text format or as JSON"""
+    def __init__(self):
+        self.metrics = {}
+        self.descriptions = {}
+
+    def _register(self, kind, cls, name, description, labels, *args):
+        key = (name, tuple(sorted((labels or {}).items())))
+        metric = self.metrics.get(key)
+        if metric is None or kind == "gauge":
+            metric = self.metrics[key] = cls(name, *args, labels=labels)
+            self.descriptions[name] = (kind, description)
+        return metric
+
+    def counter(self, name, description, labels=None):
+        return self._register("counter", Counter, name, description, labels)
+
+    def histogram(self, name, description, labels=None):
+        return self._register("histogram", Histogram, name, description, labels)
+
+    def gauge(self, name, description, function, labels=None):
+        """Registers the function returning the value of the gauge, replacing any previous one"""
+        return self._register("gauge", Gauge, name, description, labels, function)
+
+    def render_prometheus(self):
+        lines = []
+        described = set()
+        for (name, _), metric in sorted(self.metrics.items()):
+            if name not in described:
+                kind, description = self.descriptions[name]
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} {kind}")
+                described.add(name)
+            for sample_name, labels, value in metric.samples():
+                lines.append(f"{sample_name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def as_dict(self):
+        return {sample_name + _format_labels(labels): value
+                for metric in self.metrics.values() for sample_name, labels, value in metric.samples()}
+
+
+METRICS = MetricsRegistry()
+
+STAGE_SECONDS = "mc_bc_bot_stage_seconds"
+STAGE_DESCRIPTION = "Seconds spent in each stage of the pipeline"
+STREAM_FETCH = METRICS.histogram(STAGE_SECONDS, STAGE_DESCRIPTION, {"stage": "stream_fetch"})
+TRIGGER_MATCH = METRICS.histogram(STAGE_SECONDS, STAGE_DESCRIPTION, {"stage": "is_trigger_comment"})
+VALIDATION = METRICS.histogram(STAGE_SECONDS, STAGE_DESCRIPTION, {"stage": "valid_comment"})
+CONSTRUCTION = METRICS.histogram(STAGE_SECONDS, STAGE_DESCRIPTION, {"stage": "construct_comment"})
+REPLY = METRICS.histogram(STAGE_SECONDS, STAGE_DESCRIPTION, {"stage": "reply"})
+COMMENTS_SEEN = METRICS.counter("mc_bc_bot_comments_seen_total", "Comments read from the stream")
+TRIGGERS_HIT = METRICS.counter("mc_bc_bot_triggers_hit_total", "Comments which matched a trigger")
+REPLIES_POSTED = METRICS.counter("mc_bc_bot_replies_posted_total", "Replies posted")
+RELEVANT_REPLIES = METRICS.counter("mc_bc_bot_relevant_replies_total",
+                                   "Replies with a sledge chosen for the players or keywords of the comment")
+RATELIMIT_WAITS = METRICS.counter("mc_bc_bot_ratelimit_waits_total", "Replies refused by reddit's rate limit")
+INBOX_COMMANDS = METRICS.counter("mc_bc_bot_inbox_commands_total", "Opt-out and opt-in messages applied")
+RECONNECTS = METRICS.counter("mc_bc_bot_reconnects_total", "Reconnections of the comment stream")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = METRICS
+
+    def do_GET(self):
+        body = self.registry.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_metrics_server(port, host="127.0.0.1", registry=METRICS):
+    """Serves the metrics in the Prometheus text format from a background thread"""
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry})
+    server = _ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info("Serving the metrics on http://%s:%s/metrics", host, port)
+    return server
+
+
+def dump_metrics(path, registry=METRICS):
+    """Writes the metrics as JSON, replacing the file atomically"""
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w") as metrics_file:
+        json.dump(dict(registry.as_dict(), timestamp=time.time()), metrics_file, indent=1, sort_keys=True)
+    os.replace(temporary_path, path)
+
+
+async def dump_metrics_periodically(path, interval=DUMP_INTERVAL, registry=METRICS):
+    while True:
+        await asyncio.sleep(interval)
+        dump_metrics(path, registry)
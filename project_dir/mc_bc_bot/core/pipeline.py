@@ -0,0 +1,264 @@
+import logging
+import asyncio
+from project_dir.mc_bc_bot.utils.general_utilities import run_blocking
+from project_dir.mc_bc_bot.core.settings import get_settings
+from project_dir.mc_bc_bot.core.triggers import get_trigger_matcher
+from project_dir.mc_bc_bot.core.replies import get_reply_renderer
+from project_dir.mc_bc_bot.core.relevance import get_sledge_index
+from project_dir.mc_bc_bot.core.selection import SledgeSelector
+from project_dir.mc_bc_bot.core.scheduler import ReplyScheduler
+from project_dir.mc_bc_bot.core.shedding import SheddingQueue, OverflowPolicy
+from project_dir.mc_bc_bot.core.store import BotStore
+from project_dir.mc_bc_bot.core.metrics import METRICS, TRIGGER_MATCH, VALIDATION, CONSTRUCTION, REPLY, \
+    COMMENTS_SEEN, TRIGGERS_HIT, REPLIES_POSTED, RELEVANT_REPLIES
+
+# Number of messages that may wait between the sources and the consumers
+INGEST_QUEUE_SIZE = 256
+# Number of valid messages of a platform that may wait for their reply
+REPLY_QUEUE_SIZE = 64
+# Number of concurrent tasks matching, validating and replying to messages
+CONSUMER_COUNT = 4
+
+QUEUE_DEPTH = "mc_bc_bot_queue_depth"
+QUEUE_DEPTH_DESCRIPTION = "Number of comments waiting in the queues of the pipeline"
+
+logger = logging.getLogger(__name__)
+
+
+class Message:
+    """A comment of any platform, normalized for the pipeline
+
+    :param adapter: the Adapter which read the message and replies to it
+    :param id: identifier of the message, unique across all the adapters
+    :param body: the text of the message
+    :param author: name of the author, None if it was deleted
+    :param channel: where it was posted, e.g. the subreddit. Selects the format of the reply
+    :param thread: identifier of the conversation, no sledge is repeated in it
+    :param created_at: UNIX timestamp of the message
+    :param native: the object of the platform, e.g. the praw Comment
+    """
+    __slots__ = ("adapter", "id", "body", "author", "channel", "thread", "created_at", "native")
+
+    def __init__(self, adapter, id, body, author, channel, thread, created_at, native=None):
+        self.adapter = adapter
+        self.id = id
+        self.body = body
+        self.author = author
+        self.channel = channel
+        self.thread = thread
+        self.created_at = created_at
+        self.native = native
+
+    def __repr__(self):
+        return f"Message({self.adapter.platform}:{self.id})"
+
+
+class Adapter:
+    """A platform the bot reads messages from and replies to.
+    Subclasses implement `produce` and `reply`, the other methods are optional hooks
+
+    :param bucket: the TokenBucket limiting the replies on the platform
+    """
+    platform = None
+    # False for the platforms whose ids mean nothing from one run to the next, they are not written to the store
+    keeps_processed = True
+
+    def __init__(self, bucket=None):
+        self.bucket = bucket
+
+    async def produce(self, queue):
+        """Puts the Messages of the platform in the queue until the source is exhausted"""
+        raise NotImplementedError
+
+    async def reply(self, message, body):
+        """Posts the reply to the message and returns the reply of the platform, None if it was not posted"""
+        raise NotImplementedError
+
+    def make_scheduler(self, post, queue=None, on_done=None):
+        """Returns the ReplyScheduler pacing the replies of the platform
+
+        :param queue: the SheddingQueue of the messages waiting for their reply
+        :param on_done: callable taking a message once its reply was posted or abandoned
+        """
+        return ReplyScheduler(post, bucket=self.bucket, queue=queue, on_done=on_done)
+
+    def is_new(self, message):
+        """Returns False for the messages that were already processed"""
+        return True
+
+    def mark_seen(self, message):
+        """Called once the message is done with: it was not to be replied to, or its reply was posted,
+        abandoned or dropped"""
+
+    async def is_valid(self, message):
+        """Checks of the platform, made after the author was checked"""
+        return True
+
+    def replied(self, message, reply):
+        """Called after the reply was posted"""
+
+    def tasks(self):
+        """Returns the coroutines to run alongside the pipeline, e.g. the inbox of the account"""
+        return []
+
+
+def get_undesirable_authors():
+    """Returns the lowercase names of the authors listed as undesirable in the settings.json"""
+    return get_settings().undesirable_authors
+
+
+def is_excluded_author(author, store):
+    """Returns True if the bot must not reply to the author: deleted, undesirable or opted out
+    :param author: name of the author, None if it was deleted"""
+    if author is None:
+        return True
+    return author.lower() in get_undesirable_authors() or store.is_excluded(author)
+
+
+_default_selector = SledgeSelector()
+
+
+def construct_comment(subreddit=None, text=None, thread=None, author=None, selector=None):
+    """Selects a sledge involving the players named in the text, or a random one if none is,
+    and returns it in the markdown format of the subreddit.
+    No sledge is repeated in the thread or for the author before all the others were used"""
+    renderer = get_reply_renderer()
+    sledge_index = get_sledge_index(renderer.corpus)
+
+    def relevant(accept):
+        index = sledge_index.select(text, accept=accept) if text else None
+        if index is not None:
+            RELEVANT_REPLIES.inc()
+        return index
+
+    index = (selector or _default_selector).select(len(renderer.corpus), thread, author, relevant)
+    sledge, comment = renderer.corpus[index], renderer.render(index, subreddit)
+    logger.info("The following will be the reply %s", sledge.quote)
+    return comment
+
+
+def prepare_replies():
+    """Renders the replies and indexes the sledges, which takes a while for large corpora"""
+    get_sledge_index(get_reply_renderer().corpus)
+
+
+def is_trigger_comment(comment):
+    """Verifies if the comment is one of the bot triggers"""
+    logger.debug("Checking if %s is a trigger comment", comment, extra={"sample_rate": 100})
+    return get_trigger_matcher().matches(comment.body)
+
+
+class Pipeline:
+    """Matches, validates and replies to the messages of all the adapters in one event loop.
+    `consumers` tasks process the messages of the shared queue concurrently while every adapter
+    has its own ReplyScheduler posting the replies as fast as its platform allows.
+    Both queues are bounded, the overflow policy tells what they do when a burst fills them
+
+    :param adapters: list of Adapter
+    :param store: the BotStore shared by the adapters
+    :param consumers: number of concurrent consumers
+    :param overflow: the OverflowPolicy of the queues, by default they make the sources wait
+    :param name: name of the pipeline among those sharing the store, e.g. of its worker
+    """
+    def __init__(self, adapters, store=None, consumers=CONSUMER_COUNT, overflow=None, name=None):
+        self.adapters = list(adapters)
+        self.store = store if store is not None else BotStore()
+        self.consumers = consumers
+        self.overflow = overflow or OverflowPolicy()
+        self.queue = SheddingQueue(INGEST_QUEUE_SIZE, self.overflow, "ingest", self.skip)
+        self.selector = SledgeSelector(self.store, name=name)
+        self.schedulers = {adapter: adapter.make_scheduler(self.send_reply,
+                                                           SheddingQueue(REPLY_QUEUE_SIZE, self.overflow, "reply",
+                                                                         self.skip),
+                                                           self.reply_done)
+                           for adapter in self.adapters}
+
+    async def send_reply(self, message):
+        """Replies to the message as it satisfied all the criteria.
+        The APIException raised when commenting too quickly is handled by the ReplyScheduler"""
+        with CONSTRUCTION.time():
+            body = construct_comment(message.channel, message.body, message.thread, message.author,
+                                     self.selector)
+        with REPLY.time():
+            reply = await message.adapter.reply(message, body)
+        if reply is None:
+            # Only planned, nothing was posted
+            return None
+        REPLIES_POSTED.inc()
+        message.adapter.replied(message, reply)
+        self.mark_processed(message)
+        logger.info("%s's comment %s was replied to", message.author, message)
+        return reply
+
+    def mark_processed(self, message):
+        if message.adapter.keeps_processed:
+            self.store.mark_processed(message.id)
+
+    def skip(self, message, reason):
+        """A message dropped by a queue is done with, without being replied to"""
+        message.adapter.mark_seen(message)
+
+    def reply_done(self, message):
+        """The reply to the message was posted or abandoned"""
+        message.adapter.mark_seen(message)
+
+    async def is_valid(self, message):
+        """The author is checked first as it costs no request"""
+        if is_excluded_author(message.author, self.store):
+            return False
+        return await message.adapter.is_valid(message) is True
+
+    async def process(self, message):
+        """Schedules a reply to the message if it is a trigger and it is valid.
+        A scheduled message is marked as processed once the reply is posted, and seen once it is posted or abandoned.
+        Returns True if a reply was scheduled"""
+        with TRIGGER_MATCH.time():
+            is_trigger = is_trigger_comment(message)
+        if is_trigger is True:
+            TRIGGERS_HIT.inc()
+            with VALIDATION.time():
+                is_valid = await self.is_valid(message)
+            if is_valid is True:
+                logger.info("The following comment will be replied to %s", message.body)
+                await self.schedulers[message.adapter].submit(message)
+                return True
+            self.mark_processed(message)
+        return False
+
+    async def consume(self):
+        """Processes the new messages from the queue until it is cancelled"""
+        while True:
+            message = await self.queue.get()
+            COMMENTS_SEEN.inc()
+            scheduled = False
+            try:
+                if message.adapter.is_new(message):
+                    scheduled = await self.process(message)
+            except Exception:
+                logger.exception("Failed to process the comment %s", message)
+            finally:
+                if not scheduled:
+                    message.adapter.mark_seen(message)
+                self.queue.task_done()
+
+    async def run(self):
+        """Runs until every source is exhausted and every reply was posted.
+        Raises the error of a source which failed for good"""
+        METRICS.gauge(QUEUE_DEPTH, QUEUE_DEPTH_DESCRIPTION, self.queue.qsize, {"queue": "ingest"})
+        for adapter, scheduler in self.schedulers.items():
+            METRICS.gauge(QUEUE_DEPTH, QUEUE_DEPTH_DESCRIPTION, scheduler.queue.qsize,
+                          {"queue": "reply", "platform": adapter.platform})
+        await run_blocking(prepare_replies)
+        workers = [asyncio.ensure_future(self.consume()) for _ in range(self.consumers)]
+        workers.extend(asyncio.ensure_future(scheduler.run()) for scheduler in self.schedulers.values())
+        workers.append(asyncio.ensure_future(self.store.run_flusher()))
+        workers.extend(asyncio.ensure_future(task) for adapter in self.adapters for task in adapter.tasks())
+        try:
+            await asyncio.gather(*(adapter.produce(self.queue) for adapter in self.adapters))
+            await self.queue.join()
+            for scheduler in self.schedulers.values():
+                await scheduler.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            self.store.flush()
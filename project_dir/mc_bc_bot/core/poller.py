@@ -0,0 +1,184 @@
+"""Polls the newest comments of the subreddits at the cadence of their activity instead of PRAW's backoff.
+
+The arrival rate of every subreddit is tracked with an exponentially weighted moving average. The subreddits
+are polled together, in one listing, unless a busy one would overflow the listing of the others: it is then
+polled on its own. A group is polled about once per expected comment, so that a quiet group backs off up to
+MAX_POLL_INTERVAL, doubling its interval at most at every poll. The polls of the global budget of requests
+are shared between the busy groups in proportion to the square root of their rates, which minimizes the
+average delay before a comment is seen.
+"""
+import collections
+import heapq
+import logging
+import math
+import time
+from project_dir.mc_bc_bot.core.store import comment_number
+from project_dir.mc_bc_bot.core.metrics import METRICS, STREAM_FETCH
+
+# Comments returned by one request of a listing
+LISTING_LIMIT = 100
+# Requests per second spent polling all the subreddits, the replies and the ancestry need the rest of the budget
+POLL_BUDGET = 0.5
+# Bounds of the number of seconds between two polls of a group of subreddits
+MIN_POLL_INTERVAL = 2.0
+MAX_POLL_INTERVAL = 120.0
+# Number of new comments a poll is expected to return, fewer means that the group is polled too often
+COMMENTS_PER_POLL = 1.0
+# A poll should fill at most this share of the listing, so that no comment is missed between two polls
+LISTING_FILL = 0.5
+# Seconds after which an observed rate only weighs 1/e in the average
+RATE_WINDOW = 60.0
+# Comments per second assumed for a subreddit which had none yet
+QUIET_RATE = 1 / 3600
+
+POLL_INTERVAL = "mc_bc_bot_poll_interval_seconds"
+POLL_INTERVAL_DESCRIPTION = "Seconds between two polls of the comments of a subreddit"
+ARRIVAL_RATE = "mc_bc_bot_comment_arrival_rate"
+ARRIVAL_RATE_DESCRIPTION = "Average number of comments per second made in a subreddit"
+
+logger = logging.getLogger(__name__)
+
+
+class SubredditRate:
+    """The arrival rate of the comments of a subreddit and its newest comment polled
+
+    :param name: name of the subreddit
+    """
+    def __init__(self, name):
+        self.name = name
+        self.rate = QUIET_RATE
+        self.newest = None
+        self.interval = MIN_POLL_INTERVAL
+        self.observed = False
+
+    def observe(self, count, elapsed, full=False):
+        """Updates the rate with the number of comments made in the elapsed seconds
+
+        :param full: True if the listing was full, some comments were then probably missed
+        """
+        elapsed = max(elapsed, 1e-3)
+        observed = count / elapsed
+        if not self.observed or full:
+            self.rate = max(self.rate, observed) if self.observed else observed
+        else:
+            self.rate += (1 - math.exp(-elapsed / RATE_WINDOW)) * (observed - self.rate)
+        self.rate = max(self.rate, QUIET_RATE)
+        self.observed = True
+
+
+def group_subreddits(rates):
+    """Returns the groups of subreddits polled together. The busiest subreddits are polled on their own
+    as long as they would fill the listing of their group at the fastest cadence
+
+    :param rates: dict of subreddit -> comments per second
+    """
+    names = sorted(rates, key=rates.get, reverse=True)
+    groups = []
+    while len(names) > 1 and sum(rates[name] for name in names) * MIN_POLL_INTERVAL > LISTING_FILL * LISTING_LIMIT:
+        groups.append((names.pop(0),))
+    groups.append(tuple(names))
+    return groups
+
+
+def poll_intervals(rates, budget=POLL_BUDGET):
+    """Returns the number of seconds between two polls of every group of subreddits.
+    Busy groups share the budget, quiet ones are polled about once per expected comment. Every group is still
+    polled every MAX_POLL_INTERVAL, and often enough to not overflow its listing, even if the budget is exceeded
+
+    :param rates: dict of group -> comments per second
+    :param budget: requests per second shared by the groups
+    """
+    weights = {group: math.sqrt(max(rate, QUIET_RATE)) for group, rate in rates.items()}
+    total = sum(weights.values())
+    intervals = {}
+    for group, weight in weights.items():
+        rate = max(rates[group], QUIET_RATE)
+        interval = max(total / (budget * weight), COMMENTS_PER_POLL / rate)
+        interval = min(interval, MAX_POLL_INTERVAL, LISTING_FILL * LISTING_LIMIT / rate)
+        intervals[group] = max(interval, MIN_POLL_INTERVAL)
+    return intervals
+
+
+class AdaptivePoller:
+    """Polls the newest comments of the subreddits, each group at the cadence of its activity
+
+    :param reddit: the authenticated reddit object
+    :param subreddits: names of the subreddits
+    :param budget: requests per second spent polling all of them
+    :param rates: dict of subreddit -> SubredditRate, kept by the caller so that a new poller,
+        e.g. after the subreddits changed, starts with what was learned
+    """
+    def __init__(self, reddit, subreddits, budget=POLL_BUDGET, rates=None):
+        self.reddit = reddit
+        self.budget = budget
+        self.rates = rates if rates is not None else {}
+        self.subreddits = []
+        for name in subreddits:
+            state = self.rates.setdefault(name.lower(), SubredditRate(name))
+            self.subreddits.append(name.lower())
+            labels = {"subreddit": state.name}
+            METRICS.gauge(POLL_INTERVAL, POLL_INTERVAL_DESCRIPTION, lambda state=state: state.interval, labels)
+            METRICS.gauge(ARRIVAL_RATE, ARRIVAL_RATE_DESCRIPTION, lambda state=state: state.rate, labels)
+
+    def poll(self, group, elapsed):
+        """Returns the comments of the group newer than those already polled, the oldest first. Blocking
+
+        :param elapsed: seconds since the previous poll of the group, None if it was not polled yet
+        """
+        states = [self.rates[name] for name in group]
+        with STREAM_FETCH.time():
+            listing = list(self.reddit.subreddit("+".join(state.name for state in states)).comments(
+                limit=LISTING_LIMIT))
+        comments = []
+        for comment in reversed(listing):
+            state = self.rates[comment.subreddit.display_name.lower()]
+            number = comment_number(comment.fullname)
+            if state.newest is None or number > state.newest:
+                comments.append(comment)
+                state.newest = number if state.newest is None else max(state.newest, number)
+        if elapsed is None and len(listing) > 1:
+            # The first listing tells the recent rates from the times of its comments
+            elapsed = listing[0].created_utc - listing[-1].created_utc
+        if elapsed is not None:
+            full = len(listing) >= LISTING_LIMIT and len(comments) == len(listing)
+            counts = collections.Counter(comment.subreddit.display_name.lower() for comment in comments)
+            for name, state in zip(group, states):
+                state.observe(counts[name], elapsed, full)
+        return comments
+
+    def comments(self):
+        """Yields the new comments of all the subreddits as they are polled. Blocking, never exhausted.
+        None is yielded after a poll without new comment, so that the reader may stop"""
+        polled_at = {}
+        groups = None
+        due = []
+        while True:
+            rates = {name: self.rates[name].rate for name in self.subreddits}
+            if groups != group_subreddits(rates):
+                groups = group_subreddits(rates)
+                # The new groups are polled straight away
+                due_at = {group: at for at, group in due}
+                due = [(due_at.get(group, 0.0), group) for group in groups]
+                heapq.heapify(due)
+                logger.info("Polling the groups of subreddits %s", groups)
+            at, group = heapq.heappop(due)
+            delay = at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            now = time.monotonic()
+            comments = self.poll(group, now - polled_at[group] if group in polled_at else None)
+            intervals = poll_intervals({group: sum(self.rates[name].rate for name in group) for group in groups},
+                                       self.budget)
+            # Nothing is known about the rate of a group yet, it is polled again soon. A group which became quiet
+            # backs off gradually, a few polls without comment do not make a quiet subreddit
+            interval = intervals[group] if all(self.rates[name].observed for name in group) else MIN_POLL_INTERVAL
+            interval = min(interval, 2 * max(self.rates[name].interval for name in group))
+            for name in group:
+                self.rates[name].interval = interval
+            polled_at[group] = now
+            heapq.heappush(due, (now + interval, group))
+            logger.debug("Polled %s new comments of %s, next poll in %.1f seconds", len(comments), group,
+                         interval, extra={"sample_rate": 100})
+            if not comments:
+                yield None
+            yield from comments
@@ -1,26 +1,77 @@
 import praw
-import json
-import cachetools
+from praw.models.util import stream_generator
+import asyncio
 import logging
-import random
-import re
 import time
-import asyncio
-from prawcore.exceptions import RequestException
-from praw.exceptions import APIException
-from project_dir.mc_bc_bot.version import __loose_version__
-from project_dir.mc_bc_bot.utils.general_utilities import get_content_directory
+import requests
+from requests.adapters import HTTPAdapter
+from project_dir.mc_bc_bot.utils.general_utilities import run_blocking
+from project_dir.mc_bc_bot.core.sledges import get_sledge_corpus
+from project_dir.mc_bc_bot.core.settings import get_settings, SETTINGS_RELOAD_INTERVAL
+from project_dir.mc_bc_bot.core.ancestry import ThreadAncestry, get_account_name
+from project_dir.mc_bc_bot.core.scheduler import ReplyScheduler, TokenBucket, DEFAULT_REPLY_RATE, DEFAULT_REPLY_BURST
+from project_dir.mc_bc_bot.core.store import BotStore, CheckpointTracker
+from project_dir.mc_bc_bot.core.supervisor import StreamSupervisor
+from project_dir.mc_bc_bot.core.inbox import InboxPoller
+from project_dir.mc_bc_bot.core.poller import AdaptivePoller
+from project_dir.mc_bc_bot.core.metrics import STREAM_FETCH
+from project_dir.mc_bc_bot.core.pipeline import Adapter, Message, Pipeline, CONSUMER_COUNT
 
-SUBREDDITS = ['testingground4bots', 'CricketShitpost', 'Cricket']
-cache = cachetools.TTLCache(maxsize=100, ttl=3600)
+# Number of keep-alive connections to reddit, also the number of threads running the blocking calls
+POOL_SIZE = 16
+# Seconds to wait for the connection to reddit, then for each read of the response
+CONNECT_TIMEOUT = 5.0
+READ_TIMEOUT = 30.0
+# Comments per page of the listing read back to the checkpoints, and the most pages read.
+# Reddit serves the last 1000 items of a listing at most
+CATCH_UP_PAGE_SIZE = 100
+MAX_CATCH_UP_PAGES = 10
 
 logger = logging.getLogger(__name__)
 
 
-def get_reddit_object():
-    """Returns the praw's Reddit object taking the credentials from the praw.ini file"""
-    logger.info("Logging into the bot with the Praw.ini credentials")
-    return praw.Reddit('mc_bc_bot', user_agent='MCBCBOT (by /u/vikramaditya91)')
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """Pools the connections to reddit and applies its own timeouts to every request.
+    prawcore always passes its own single timeout, which would let a stalled read hang for as long
+    as a slow connect"""
+    def __init__(self, pool_size=POOL_SIZE, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT):
+        super().__init__(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.timeout = (connect_timeout, read_timeout)
+
+    def send(self, request, **kwargs):
+        kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def get_http_session(pool_size=POOL_SIZE, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT):
+    """Returns the keep-alive session shared by all the requests of a Reddit object:
+    the stream, the ancestry, the inbox and the replies reuse the same pooled connections"""
+    session = requests.Session()
+    adapter = TimeoutHTTPAdapter(pool_size, connect_timeout, read_timeout)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_reddit_object(site_name='mc_bc_bot', pool_size=POOL_SIZE, connect_timeout=CONNECT_TIMEOUT,
+                      read_timeout=READ_TIMEOUT):
+    """Returns the praw's Reddit object taking the credentials from the praw.ini file
+    :param site_name The section of the praw.ini with the credentials of the account
+    :param pool_size Number of keep-alive connections kept to reddit, as many calls may run concurrently
+    :param connect_timeout Seconds to wait for a connection
+    :param read_timeout Seconds to wait for each read of a response"""
+    logger.info("Logging into the bot with the Praw.ini credentials of %s", site_name)
+    session = get_http_session(pool_size, connect_timeout, read_timeout)
+    return praw.Reddit(site_name, user_agent='MCBCBOT (by /u/vikramaditya91)',
+                       requestor_kwargs={"session": session})
+
+
+def get_blocking_executor(pool_size=POOL_SIZE):
+    """Returns the executor running the blocking praw calls, with one thread per pooled connection
+    so that no call waits for a connection while holding a thread"""
+    # Imported here, only the modes with an event loop need it
+    from concurrent.futures import ThreadPoolExecutor
+    return ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="reddit")
 
 
 def get_valid_subreddits(reddit):
@@ -30,109 +81,226 @@ def get_valid_subreddits(reddit):
     :return list of subreddit objects
     """
     subreddits = []
-    for subreddit in SUBREDDITS:
+    for subreddit in get_settings().subreddits:
         subreddits.append(reddit.subreddit(subreddit))
     return subreddits
 
 
-async def ensure_not_child_of_bot_comment(comment):
+async def ensure_not_child_of_bot_comment(comment, ancestry):
     """This ensures that the bot is not replying to a thread whose parent is from the bot.
-    Mainly to avoid spam"""
-    bots_thread = True
-    logger.info(f"Checking if the comment {comment.body} is a child of the mc_bc_bot comment")
-    try:
-        parent = comment.parent()
-        if parent.author.name == "mc_bc_bot":
-            bots_thread = False
-        ensure_not_child_of_bot_comment(parent)
-        return bots_thread
-    except AttributeError as e:
-        if "'Submission' object has no attribute 'parent'" in str(e):
-            return
-        raise
-
-
-@cachetools.cached(cache)
-def get_triggers_from_json():
-    """Parse the json file which contains information about the triggers"""
-    with open(get_content_directory() / "triggers.json", "r") as triggers:
-        return json.load(triggers)
-
-
-async def valid_comment(comment):
-    """A valid comment should satisfy the following criteria
-    1) Any of its parents should not have already been replied to by the mc_bc_bot
-    2) The comment itself should not have been made by someone in the list"""
-    if await ensure_not_child_of_bot_comment(comment) is True:
-        if comment.author.name not in get_triggers_from_json()['undesirable']:
-            return True
-    return False
+    Mainly to avoid spam
+    :return True if none of the parents of the comment was made by the bot"""
+    logger.info("Checking if the comment %s is a child of the mc_bc_bot comment", comment.id,
+                extra={"sample_rate": 10})
+    return not await ancestry.bot_in_chain(comment)
 
 
 def get_all_sledges():
-    """Parse the json file for a random sledge
+    """Returns all the sledges of the sledges.json
     :return A dict of sledges"""
-    with open(get_content_directory()/"sledges.json", "r") as sledge_file:
-        return json.load(sledge_file)
-
-
-def construct_comment():
-    """Randomly selects a sledge and writes in the markdown format"""
-    quote, [perp, victim, context] = random.choice(list(get_all_sledges().items()))
-    logger.info(f"The following will be the reply {quote}")
-    comment = quote.upper()
-    comment += f"\n\n*{perp}* to *{victim}*"
-    comment += f"\n\n{context}"
-    comment += f"\n\n---\n\n"
-    comment += f"^[source-code](https://github.com/vikramaditya91/mc_bc_bot)" \
-        f" ^|" \
-        f" ^[opt-out](https://reddit.com/message/compose?to=mc_bc_bot&message=Excludeme&subject=Excludeme)" \
-        f" ^|" \
-        f" ^[PM](https://www.reddit.com/message/compose?to=vikramaditya91)" \
-        f" ^|" \
-        f" ^v{__loose_version__}"
-    return comment
-
-
-def is_trigger_comment(comment):
-    """Verifies if the comment is one of the bot triggers"""
-    logging.info(f"Checking if {comment.body} is a trigger comment")
-    return any(ele in comment.body.lower() for ele in get_triggers_from_json()['triggered_by'])
-
-
-async def reply_to_said_comment(comment, tries=2):
-    """Replies to the comment as it satisfied all the criteria.
-    Waits for the time to pass if you commented too quickly"""
-    if tries <= 0:
-        return
-    try:
-        tries = tries - 1
-        comment_to_reply = construct_comment()
-        comment.reply(comment_to_reply)
-        logger.info(f"{comment.author}'s comment was replied to at {comment.permalink}")
-    except APIException as e:
-        logger.info(f"Caught an exception with {e} while trying to post a comment")
-        minutes = re.findall("RATELIMIT: 'you are doing that too much. try again in (.*\d+) minutes", str(e))
-        seconds = re.findall("RATELIMIT: 'you are doing that too much. try again in (.*\d+) seconds", str(e))
-        minutes_to_wait = int(next(iter(minutes), 0))
-        seconds_to_wait = int(next(iter(seconds), 0))
-        buffer_wait_seconds = 60
-        logger.info(f"Shall asynchronously wait {minutes_to_wait} minutes"
-                    f" and {seconds_to_wait+buffer_wait_seconds} seconds")
-        await asyncio.sleep(60*minutes_to_wait+seconds_to_wait+buffer_wait_seconds)
-        reply_to_said_comment(comment, tries)
-
-
-async def comment_reply_maker(required_subreddits):
-    """Replies to the comments on the given subredits.
-    Carries out an infinite loop in case of network failure"""
-    try:
-        for comment in required_subreddits.stream.comments(skip_existing=True):
-            if is_trigger_comment(comment) is True:
-                if await valid_comment(comment) is True:
-                    logger.info(f"The following comment will be replied to {comment.body}")
-                    await reply_to_said_comment(comment)
-    except RequestException as e:
-        if "Failed to establish a new connection" in str(e):
-            time.sleep(2)
-            await comment_reply_maker(required_subreddits)
\ No newline at end of file
+    return get_sledge_corpus().to_dict()
+
+
+def is_new_comment(comment, store, started_at):
+    """Returns False for the comments that were already processed before a restart.
+    In subreddits without a checkpoint, only the comments made after the start are new"""
+    if store.is_processed(comment.id):
+        return False
+    subreddit = comment.subreddit.display_name
+    if store.checkpoint(subreddit) is None:
+        return comment.created_utc >= started_at
+    return not store.is_before_checkpoint(subreddit, comment.fullname)
+
+
+def timed_listing(listing):
+    """Wraps a listing function so that STREAM_FETCH observes the request of every page, without the pauses
+    of the stream between them"""
+    def fetch(*args, **kwargs):
+        with STREAM_FETCH.time():
+            return list(listing(*args, **kwargs))
+    return fetch
+
+
+def catch_up_comments(listing, subreddits, store, started_at, max_pages=MAX_CATCH_UP_PAGES):
+    """Returns the new comments made since the checkpoints of the subreddits, the oldest first.
+    A stream starts with the latest page only, the listing is paged back until it reaches the checkpoint of every
+    subreddit, and the start for those without one, so that the comments made while the bot was down are not missed
+
+    :param listing: function fetching a page of the comments of the subreddits, the newest first
+    :param subreddits: names of the subreddits of the listing
+    """
+    unreached = {name.lower() for name in subreddits if store.checkpoint(name) is not None}
+    unchecked = len(unreached) < len(subreddits)
+    comments = []
+    after = None
+    for _ in range(max_pages):
+        page = listing(limit=CATCH_UP_PAGE_SIZE, params={"after": after} if after is not None else None)
+        for comment in page:
+            if is_new_comment(comment, store, started_at):
+                comments.append(comment)
+            else:
+                unreached.discard(comment.subreddit.display_name.lower())
+        if len(page) < CATCH_UP_PAGE_SIZE:
+            break
+        # The listing is ordered by time: once a comment is older than the start, so are the following ones
+        if unchecked and page[-1].created_utc < started_at:
+            unchecked = False
+        if not unreached and not unchecked:
+            break
+        after = page[-1].fullname
+    else:
+        logger.warning("Read back %s comments without reaching the checkpoints of %s", len(comments),
+                       sorted(unreached))
+    comments.reverse()
+    return comments
+
+
+def to_message(adapter, comment):
+    """Normalizes the praw Comment for the pipeline"""
+    return Message(adapter, comment.id, comment.body, comment.author.name if comment.author else None,
+                   comment.subreddit.display_name, comment.link_id, comment.created_utc, comment)
+
+
+class RedditAdapter(Adapter):
+    """Streams the comments of the subreddits and replies to them with the account of the reddit object.
+    Every stream starts with the comments made since the checkpoints of the store, read back page by page.
+    The checkpoint of a subreddit stays below the comments which are still in the pipeline, from the moment they
+    are queued until their reply was posted, so that they are processed again after a restart.
+    The stream is reconnected by the StreamSupervisor in case of network failure.
+    The opt-out messages of the inbox are applied meanwhile by the InboxPoller.
+    When it follows the settings, the subreddits and the reply budget of the settings.json are applied
+    as soon as the file is modified, the stream is only subscribed again when the subreddits changed.
+    With a polling budget, the subreddits are polled separately by an AdaptivePoller instead of PRAW's stream
+
+    :param required_subreddits: the praw Subreddit to stream, usually several of them joined with +
+    :param store: the BotStore of the pipeline
+    :param started_at: UNIX timestamp before which the comments of subreddits without checkpoint are old
+    :param bucket: the TokenBucket limiting the replies of the account
+    :param follow_settings: True to apply the changes of the settings.json while running
+    :param poll_budget: requests per second spent polling the subreddits, None to stream them with PRAW
+    """
+    platform = "reddit"
+
+    def __init__(self, required_subreddits, store, ancestry=None, started_at=None, bucket=None, inbox=None,
+                 follow_settings=False, poll_budget=None):
+        if follow_settings:
+            settings = get_settings()
+            if bucket is None:
+                bucket = TokenBucket(settings.reply_rate or DEFAULT_REPLY_RATE,
+                                     settings.reply_burst or DEFAULT_REPLY_BURST)
+            if poll_budget is None:
+                poll_budget = settings.poll_budget()
+        super().__init__(bucket)
+        self.subreddits = required_subreddits
+        self.reddit = required_subreddits._reddit
+        self.store = store
+        self.checkpoints = CheckpointTracker(store)
+        # Ids of the comments queued, being validated or waiting for their reply
+        self.in_flight = set()
+        self.ancestry = ancestry or ThreadAncestry(self.reddit, bot_name=get_account_name(self.reddit))
+        self.started_at = time.time() if started_at is None else started_at
+        self.inbox = inbox or InboxPoller(self.reddit, store)
+        self.follow_settings = follow_settings
+        self.supervisor = None
+        self.poll_budget = poll_budget
+        self.poller = None
+        # The rates learned by the pollers, kept when the stream is created again
+        self.poll_rates = {}
+
+    def comment_stream(self):
+        """Returns PRAW's stream of the comments of the subreddits, the same as `subreddits.stream.comments()`"""
+        return stream_generator(timed_listing(self.subreddits.comments))
+
+    def caught_up(self, comments):
+        """Yields the comments missed since the checkpoints, then those of the stream which were not among them"""
+        missed = catch_up_comments(timed_listing(self.subreddits.comments), self.subreddits.display_name.split("+"),
+                                   self.store, self.started_at)
+        if missed:
+            logger.info("Caught up with %s comments made since the checkpoints", len(missed))
+        yield from missed
+        fullnames = {comment.fullname for comment in missed}
+        for comment in comments:
+            if comment is None or comment.fullname not in fullnames:
+                yield comment
+
+    def stream_messages(self):
+        if self.poll_budget is None:
+            comments = self.comment_stream()
+        else:
+            self.poller = AdaptivePoller(self.reddit, self.subreddits.display_name.split("+"), self.poll_budget,
+                                         self.poll_rates)
+            comments = self.poller.comments()
+        return (to_message(self, comment) if comment is not None else None for comment in self.caught_up(comments))
+
+    async def produce(self, queue):
+        self.supervisor = StreamSupervisor(self.stream_messages, queue, admit=self.admit)
+        await self.supervisor.run()
+
+    def apply_settings(self, settings):
+        """Subscribes to the subreddits of the settings if they changed and applies their reply budget"""
+        subscription = frozenset(name.lower() for name in self.subreddits.display_name.split("+"))
+        if settings.subscription() != subscription:
+            self.subreddits = self.reddit.subreddit("+".join(settings.subreddits))
+            logger.info("Streaming the subreddits %s", settings.subreddits)
+            if self.supervisor is not None:
+                self.supervisor.restart()
+        self.bucket.configure(settings.reply_rate or DEFAULT_REPLY_RATE, settings.reply_burst or DEFAULT_REPLY_BURST)
+        if self.poller is not None and settings.poll_budget() is not None:
+            self.poller.budget = self.poll_budget = settings.poll_budget()
+
+    async def watch_settings(self):
+        """Applies every new version of the settings.json"""
+        settings = get_settings()
+        while True:
+            await asyncio.sleep(SETTINGS_RELOAD_INTERVAL)
+            try:
+                if get_settings() is not settings:
+                    settings = get_settings()
+                    self.apply_settings(settings)
+            except Exception:
+                # Nothing awaits this task, it must outlive a bad version of the file
+                logger.exception("Could not apply the settings, they are checked again in %s seconds",
+                                 SETTINGS_RELOAD_INTERVAL)
+
+    async def reply(self, message, body):
+        return await run_blocking(message.native.reply, body)
+
+    def make_scheduler(self, post, queue=None, on_done=None):
+        return ReplyScheduler(post, reddit=self.reddit, bucket=self.bucket, queue=queue, on_done=on_done)
+
+    def is_new(self, message):
+        return is_new_comment(message.native, self.store, self.started_at)
+
+    def admit(self, message):
+        """Holds the checkpoint below the message from the moment it is queued until it is seen.
+        Returns False for a message which is still in the pipeline, yielded again by a new stream"""
+        if message.id in self.in_flight:
+            return False
+        self.in_flight.add(message.id)
+        self.checkpoints.hold(message.channel, message.native.fullname)
+        return True
+
+    def mark_seen(self, message):
+        self.in_flight.discard(message.id)
+        self.checkpoints.release(message.channel, message.native.fullname)
+
+    async def is_valid(self, message):
+        return await ensure_not_child_of_bot_comment(message.native, self.ancestry)
+
+    def replied(self, message, reply):
+        self.ancestry.record_bot_reply(reply)
+        logger.info("Replied at %s", message.native.permalink)
+
+    def tasks(self):
+        if self.follow_settings:
+            return [self.inbox.run(), self.watch_settings()]
+        return [self.inbox.run()]
+
+
+async def comment_reply_maker(required_subreddits, consumers=CONSUMER_COUNT, ancestry=None, store=None,
+                              started_at=None, bucket=None, inbox=None, overflow=None, poll_budget=None, name=None):
+    """Replies to the comments on the given subredits with the RedditAdapter as the only source"""
+    store = store if store is not None else BotStore()
+    adapter = RedditAdapter(required_subreddits, store, ancestry, started_at, bucket, inbox,
+                            poll_budget=poll_budget)
+    await Pipeline([adapter], store, consumers, overflow, name).run()
@@ -0,0 +1,159 @@
+import array
+import bisect
+import json
+import random
+import re
+import logging
+import threading
+from project_dir.mc_bc_bot.utils.general_utilities import get_content_directory, WatchedFile
+from project_dir.mc_bc_bot.core.triggers import normalize_text
+
+# Minimum number of seconds between two checks of the modification time of aliases.json
+ALIASES_RELOAD_INTERVAL = 5.0
+# Keywords of the contexts which are shorter or in more than this share of the sledges are not indexed
+KEYWORD_MIN_LENGTH = 4
+KEYWORD_MAX_SHARE = 0.05
+# Keywords in fewer sledges than this are always indexed, whatever the size of the corpus
+KEYWORD_MIN_POSTINGS = 8
+# Only this many sledges of the shortest list are checked when intersecting the lists of several players
+INTERSECTION_SCAN_LIMIT = 1000
+# Number of random sledges of the named players tried before looking for one which was not used yet
+RELEVANT_DRAWS = 8
+STOP_WORDS = frozenset("""
+about after again against also asked back been before being came could didn does during england english every
+first from going have having into just like made make more most much only other over said same should some
+still than that their them then there these they this those through time under very want were what when where
+which while will with would your australia australian
+""".split())
+
+_WORD = re.compile(r"\w+")
+
+logger = logging.getLogger(__name__)
+
+
+def tokenize(text):
+    """Returns the normalized words of the text"""
+    return _WORD.findall(normalize_text(text))
+
+
+def load_aliases(path):
+    """Reads the aliases.json {player: [alias, ...]}"""
+    with open(path, "r") as aliases_file:
+        return json.load(aliases_file)
+
+
+class SledgeIndex:
+    """Inverted index of the players (full names, surnames and aliases) and of the keywords of the contexts
+    of the sledges. Every term maps to the sorted array of the indices of its sledges, so that selecting a
+    sledge for a comment only costs a lookup per word of the comment
+
+    :param corpus: the SledgeCorpus or MappedSledgeCorpus
+    :param aliases: dict of player -> list of aliases
+    """
+    def __init__(self, corpus, aliases):
+        self.corpus = corpus
+        self.aliases = aliases
+        players, keywords = {}, {}
+        for index, sledge in enumerate(corpus):
+            for player in (sledge.perpetrator, sledge.victim):
+                for term in self.player_terms(player):
+                    postings = players.setdefault(term, array.array("I"))
+                    if not postings or postings[-1] != index:
+                        postings.append(index)
+            for term in set(tokenize(sledge.context)):
+                if len(term) >= KEYWORD_MIN_LENGTH and term not in STOP_WORDS and not term.isdigit():
+                    keywords.setdefault(term, array.array("I")).append(index)
+        keyword_limit = max(KEYWORD_MIN_POSTINGS, KEYWORD_MAX_SHARE * len(corpus))
+        self.players = players
+        self.keywords = {term: postings for term, postings in keywords.items() if len(postings) <= keyword_limit}
+        logger.info("Indexed %s player terms and %s keywords of %s sledges",
+                    len(self.players), len(self.keywords), len(corpus))
+
+    def player_terms(self, player):
+        """Returns the terms under which the player is indexed: the full name, the surname and the aliases.
+        Surnames are only taken from capitalized names, "the umpire" is no player called Umpire"""
+        words = player.split()
+        terms = {" ".join(tokenize(player))}
+        if words and words[-1][:1].isupper():
+            terms.add(normalize_text(words[-1]))
+        terms.update(" ".join(tokenize(alias)) for alias in self.aliases.get(player, ()))
+        terms.discard("")
+        return terms
+
+    def matches(self, text):
+        """Returns the posting lists of the players named in the text, or of its keywords if no player is named.
+        A full name or alias of two words hides the player terms of its words: Steve Waugh is not Mark Waugh"""
+        words = tokenize(text)
+        players, used = {}, set()
+        for position in range(len(words) - 1):
+            term = f"{words[position]} {words[position + 1]}"
+            if term in self.players:
+                players[term] = self.players[term]
+                used.update((position, position + 1))
+        for position, word in enumerate(words):
+            if position not in used and word in self.players:
+                players[word] = self.players[word]
+        if players:
+            return list(players.values())
+        return list({word: self.keywords[word] for word in words if word in self.keywords}.values())
+
+    def select(self, text, rng=random, accept=None):
+        """Returns the index of a sledge relevant to the text, None if nothing in the text is indexed.
+        The sledges involving all the named players are preferred, then any sledge of any of them
+
+        :param accept: predicate on the indices, e.g. to skip the sledges already used in the thread
+        """
+        accept = accept or _accept_all
+        lists = self.matches(text)
+        if not lists:
+            return None
+        if len(lists) > 1:
+            lists.sort(key=len)
+            shortest, others = lists[0], lists[1:]
+            start = rng.randrange(len(shortest)) if len(shortest) > INTERSECTION_SCAN_LIMIT else 0
+            common = [index for index in shortest[start:start + INTERSECTION_SCAN_LIMIT]
+                      if accept(index) and all(_contains(postings, index) for postings in others)]
+            if common:
+                return rng.choice(common)
+        total = sum(len(postings) for postings in lists)
+        for _ in range(RELEVANT_DRAWS):
+            index = _nth(lists, rng.randrange(total))
+            if accept(index):
+                return index
+        if total <= INTERSECTION_SCAN_LIMIT:
+            candidates = [index for postings in lists for index in postings if accept(index)]
+            if candidates:
+                return rng.choice(candidates)
+        return None
+
+
+def _accept_all(index):
+    return True
+
+
+def _nth(lists, position):
+    for postings in lists:
+        if position < len(postings):
+            return postings[position]
+        position -= len(postings)
+
+
+def _contains(postings, index):
+    position = bisect.bisect_left(postings, index)
+    return position < len(postings) and postings[position] == index
+
+
+_aliases_file = WatchedFile(get_content_directory() / "aliases.json", load_aliases, interval=ALIASES_RELOAD_INTERVAL)
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_sledge_index(corpus):
+    """Returns the index of the corpus, built again only when the corpus or the aliases.json changed"""
+    global _index
+    aliases = _aliases_file.get()
+    if _index is None or _index.corpus is not corpus or _index.aliases is not aliases:
+        with _index_lock:
+            if _index is None or _index.corpus is not corpus or _index.aliases is not aliases:
+                _index = SledgeIndex(corpus, aliases)
+    return _index
@@ -0,0 +1,102 @@
+import json
+import cachetools
+import logging
+import threading
+from project_dir.mc_bc_bot.version import __loose_version__
+from project_dir.mc_bc_bot.utils.general_utilities import get_content_directory, WatchedFile
+from project_dir.mc_bc_bot.core.sledges import get_sledge_corpus
+
+# Minimum number of seconds between two checks of the modification time of reply_formats.json
+FORMATS_RELOAD_INTERVAL = 5.0
+# Corpora with more sledges are rendered on demand instead of all at once, they would not fit in memory
+PRERENDER_LIMIT = 10000
+# Number of bodies kept by the renderer of a large corpus
+RENDER_CACHE_SIZE = 1024
+
+logger = logging.getLogger(__name__)
+
+
+def load_reply_formats(path):
+    """Reads the reply_formats.json: a default format and the per-subreddit overrides of any of its keys.
+    :return dict of lowercase subreddit -> format, the default format is under the key None"""
+    with open(path, "r") as formats_file:
+        formats_json = json.load(formats_file)
+    default = formats_json["default"]
+    formats = {None: default}
+    for subreddit, overrides in formats_json.get("subreddits", {}).items():
+        formats[subreddit.lower()] = dict(default, **overrides)
+    return formats
+
+
+def render_body(template, sledge):
+    return template.format(quote=sledge.quote, quote_upper=sledge.quote.upper(), perpetrator=sledge.perpetrator,
+                           victim=sledge.victim, context=sledge.context)
+
+
+class LazyBodies:
+    """The bodies of a large corpus, rendered when they are first used and kept in a LRU cache"""
+    def __init__(self, template, corpus, maxsize=RENDER_CACHE_SIZE):
+        self.template = template
+        self.corpus = corpus
+        self.cache = cachetools.LRUCache(maxsize=maxsize)
+
+    def __getitem__(self, index):
+        body = self.cache.get(index)
+        if body is None:
+            body = self.cache[index] = render_body(self.template, self.corpus[index])
+        return body
+
+
+class ReplyRenderer:
+    """Renders every sledge in every format once, so that building a reply is a lookup and a concatenation.
+    The sledges of corpora larger than PRERENDER_LIMIT are rendered on demand.
+    A body template receives the fields quote, quote_upper, perpetrator, victim and context of the sledge,
+    a footer template receives the version
+
+    :param corpus: the SledgeCorpus or MappedSledgeCorpus
+    :param formats: dict returned by load_reply_formats
+    :param version: the version written in the footer
+    """
+    def __init__(self, corpus, formats, version=__loose_version__):
+        self.corpus = corpus
+        self.formats = formats
+        self.version = version
+        self.variants = {}
+        rendered = {}
+        for subreddit, reply_format in formats.items():
+            key = (reply_format["body"], reply_format["separator"] + reply_format["footer"])
+            if key not in rendered:
+                rendered[key] = (self._render_bodies(key[0]), key[1].format(version=version))
+            self.variants[subreddit] = rendered[key]
+        logger.info("Rendered %s sledges in %s formats", len(corpus), len(rendered))
+
+    def _render_bodies(self, template):
+        if len(self.corpus) > PRERENDER_LIMIT:
+            return LazyBodies(template, self.corpus)
+        return tuple(render_body(template, sledge) for sledge in self.corpus)
+
+    def is_rendered_from(self, corpus, formats, version):
+        return self.corpus is corpus and self.formats is formats and self.version == version
+
+    def render(self, index, subreddit=None):
+        """Returns the reply with the sledge at `index` in the format of the subreddit"""
+        bodies, footer = self.variants.get(subreddit and subreddit.lower(), self.variants[None])
+        return bodies[index] + footer
+
+
+_formats_file = WatchedFile(get_content_directory() / "reply_formats.json", load_reply_formats,
+                            interval=FORMATS_RELOAD_INTERVAL)
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+def get_reply_renderer(version=__loose_version__):
+    """Returns the renderer of the current corpus and formats. It is rendered again only when
+    the sledges.json or the reply_formats.json was modified, or the version changed"""
+    global _renderer
+    corpus, formats = get_sledge_corpus(), _formats_file.get()
+    if _renderer is None or not _renderer.is_rendered_from(corpus, formats, version):
+        with _renderer_lock:
+            if _renderer is None or not _renderer.is_rendered_from(corpus, formats, version):
+                _renderer = ReplyRenderer(corpus, formats, version)
+    return _renderer
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import re
+import time
+from praw.exceptions import APIException
+from project_dir.mc_bc_bot.core.metrics import RATELIMIT_WAITS
+from project_dir.mc_bc_bot.core.shedding import SheddingQueue
+
+# Replies per second allowed before reddit told us anything about the rate limit
+DEFAULT_REPLY_RATE = 1 / 10
+# Number of replies which may be posted back to back
+DEFAULT_REPLY_BURST = 2
+# Seconds added to the wait asked by reddit, in case the clocks do not agree
+RATELIMIT_BUFFER_SECONDS = 5
+
+logger = logging.getLogger(__name__)
+
+
+def parse_ratelimit_wait(exception):
+    """Returns the number of seconds reddit asked to wait in a RATELIMIT exception, None for any other exception"""
+    if "RATELIMIT" not in str(exception):
+        return None
+    minutes = re.findall(r"(\d+) minute", str(exception))
+    seconds = re.findall(r"(\d+) second", str(exception))
+    return 60 * int(next(iter(minutes), 0)) + int(next(iter(seconds), 0))
+
+
+class TokenBucket:
+    """Allows `rate` operations per second on average and at most `capacity` of them at once
+
+    :param rate: number of tokens added per second
+    :param capacity: maximum number of tokens held
+    """
+    def __init__(self, rate=DEFAULT_REPLY_RATE, capacity=DEFAULT_REPLY_BURST):
+        self.base_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def delay(self):
+        """Returns the number of seconds until a token is available"""
+        now = time.monotonic()
+        self._refill(now)
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self._refill(time.monotonic())
+        self.tokens -= 1
+
+    def configure(self, rate, capacity):
+        """Changes the budget, e.g. after the settings.json was modified.
+        A rate lowered by the ratelimit headers stays so until the next headers"""
+        self._refill(time.monotonic())
+        throttled = self.rate < self.base_rate
+        self.base_rate = rate
+        self.rate = min(self.rate, rate) if throttled else rate
+        self.capacity = capacity
+        self.tokens = min(self.tokens, capacity)
+
+    def pause(self, seconds):
+        """Gives no token for the given number of seconds, as asked by a RATELIMIT response"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    def update_from_limits(self, limits):
+        """Adapts the rate to the remaining requests of the window announced in reddit's ratelimit headers
+
+        :param limits: the dict returned by `reddit.auth.limits`
+        """
+        remaining, reset_timestamp = limits.get("remaining"), limits.get("reset_timestamp")
+        if remaining is None or reset_timestamp is None:
+            return
+        seconds_to_reset = reset_timestamp - time.time()
+        if seconds_to_reset <= 0:
+            return
+        if remaining < 1:
+            self.pause(seconds_to_reset)
+            return
+        self.rate = min(self.base_rate, remaining / seconds_to_reset)
+
+
+class ReplyScheduler:
+    """Queues the replies and posts them from a single task as soon as the rate limit allows it.
+    The callers only submit the replies and never wait for the rate limit themselves.
+
+    :param post: coroutine function posting the reply to the given comment
+    :param reddit: the authenticated reddit object whose ratelimit headers seed the bucket
+    :param bucket: the TokenBucket limiting the replies
+    :param tries: number of times a reply is attempted
+    :param queue: the SheddingQueue of the comments waiting for their reply, unbounded by default
+    :param on_done: callable taking a comment once its reply was posted or abandoned
+    """
+    def __init__(self, post, reddit=None, bucket=None, tries=2, queue=None, on_done=None):
+        self.post = post
+        self.reddit = reddit
+        self.bucket = bucket or TokenBucket()
+        self.tries = tries
+        self.queue = queue if queue is not None else SheddingQueue(name="reply")
+        self.on_done = on_done
+        self.ratelimit_waits = 0
+
+    async def submit(self, comment):
+        """Queues a reply to the comment. A full queue waits for room or drops a comment, as its policy says"""
+        await self.queue.put(comment)
+
+    async def join(self):
+        """Waits until every submitted reply was posted or abandoned"""
+        await self.queue.join()
+
+    async def run(self):
+        """Posts the queued replies until it is cancelled"""
+        while True:
+            comment = await self.queue.get()
+            try:
+                for _ in range(self.tries):
+                    if await self._send(comment):
+                        break
+            finally:
+                self.queue.task_done()
+                if self.on_done is not None:
+                    self.on_done(comment)
+
+    async def _send(self, comment):
+        """Posts the reply, returns False if it should be tried again after the pause asked by reddit"""
+        delay = self.bucket.delay()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self.bucket.delay()
+        self.bucket.consume()
+        try:
+            await self.post(comment)
+        except APIException as e:
+            wait = parse_ratelimit_wait(e)
+            if wait is None:
+                logger.error("Could not reply to %s: %s", comment, e)
+                return True
+            self.ratelimit_waits += 1
+            RATELIMIT_WAITS.inc()
+            logger.info("Rate limited while replying to %s, no reply is posted for %s seconds", comment, wait)
+            self.bucket.pause(wait + RATELIMIT_BUFFER_SECONDS)
+            return False
+        except Exception:
+            logger.exception("Could not reply to %s", comment)
+        finally:
+            if self.reddit is not None:
+                self.bucket.update_from_limits(self.reddit.auth.limits)
+        return True
@@ -0,0 +1,144 @@
+import functools
+import random
+import logging
+import cachetools
+
+# Number of threads and authors whose used sledges are remembered, the least recently active are forgotten
+BAG_CACHE_SIZE = 10000
+# Number of draws of the global bag rejected because of a thread or an author before scanning the corpus
+MAX_REJECTED_DRAWS = 32
+# Key of the global bag in the store, followed by the name of its pipeline when the store is shared
+GLOBAL_BAG = "global"
+
+logger = logging.getLogger(__name__)
+
+
+class ShuffleBag:
+    """Draws every index of range(size) once, in random order, before starting again.
+    The permutation is built lazily (Fisher-Yates from the end), so a draw is O(1) and the memory
+    only grows with the number of draws since the bag was refilled
+
+    :param size: number of indices in the bag
+    """
+    def __init__(self, size, remaining=None, swaps=None, rng=random):
+        self.size = size
+        self.remaining = size if remaining is None else remaining
+        self.swaps = dict(swaps or {})
+        self.rng = rng
+
+    def draw(self):
+        if self.remaining == 0:
+            self.remaining = self.size
+            self.swaps.clear()
+        position = self.rng.randrange(self.remaining)
+        last = self.remaining - 1
+        index = self.swaps.get(position, position)
+        self.swaps[position] = self.swaps.pop(last, last)
+        if position == last:
+            del self.swaps[position]
+        self.remaining = last
+        return index
+
+    def put_back(self, index):
+        """Returns the index just drawn to the bag"""
+        self.swaps[self.remaining] = index
+        self.remaining += 1
+
+    def state(self):
+        return {"size": self.size, "remaining": self.remaining, "swaps": list(self.swaps.items())}
+
+    @classmethod
+    def from_state(cls, state, rng=random):
+        return cls(state["size"], state["remaining"], {int(key): value for key, value in state["swaps"]}, rng)
+
+
+class _UsedSledges(cachetools.LRUCache):
+    """The sledges used in each thread or for each author. Evicted keys are forgotten by the store too"""
+    def __init__(self, maxsize, store):
+        super().__init__(maxsize)
+        self.store = store
+
+    def popitem(self):
+        key, used = super().popitem()
+        if self.store is not None:
+            self.store.forget_bag(key)
+        return key, used
+
+
+class SledgeSelector:
+    """Selects the sledges so that none is repeated before all the others were used: globally,
+    in a thread and for an author. The global order comes from a ShuffleBag, a sledge already used
+    in the thread or for the author of the comment is put back and another one is drawn.
+    The state is saved in the store and restored after a restart
+
+    :param store: the BotStore keeping the bags, None to keep them in memory only
+    :param maxsize: number of threads and authors remembered
+    :param name: name of the pipeline, so that each of those sharing the store keeps its own global bag
+    """
+    def __init__(self, store=None, maxsize=BAG_CACHE_SIZE, rng=random, name=None):
+        self.store = store
+        self.rng = rng
+        self.bag = None
+        self.bag_key = GLOBAL_BAG if name is None else f"{GLOBAL_BAG}:{name}"
+        self.used = _UsedSledges(maxsize, store)
+        if store is not None:
+            bags = store.load_bags(maxsize + 1)
+            if self.bag_key in bags:
+                self.bag = ShuffleBag.from_state(bags[self.bag_key], rng)
+            for key, state in reversed(list(bags.items())):
+                if key.split(":", 1)[0] != GLOBAL_BAG:
+                    self.used[key] = (state["size"], set(state["used"]))
+            logger.info("Restored the shuffle bags of %s threads and authors", len(self.used))
+
+    @staticmethod
+    def keys(thread=None, author=None):
+        return [key for key in (thread and f"thread:{thread}", author and f"author:{author.lower()}") if key]
+
+    def _used_sets(self, keys, size):
+        sets = []
+        for key in keys:
+            bag_size, used = self.used.get(key, (size, set()))
+            if bag_size != size or len(used) >= size:
+                # The corpus changed or every sledge was used once: the bag starts again
+                used = set()
+            self.used[key] = (size, used)
+            sets.append(used)
+        return sets
+
+    def _draw(self, size, accept):
+        if self.bag is None or self.bag.size != size:
+            self.bag = ShuffleBag(size, rng=self.rng)
+        for _ in range(MAX_REJECTED_DRAWS):
+            index = self.bag.draw()
+            if accept(index):
+                return index
+            self.bag.put_back(index)
+        candidates = [index for index in range(size) if accept(index)]
+        return self.rng.choice(candidates) if candidates else self.bag.draw()
+
+    def select(self, size, thread=None, author=None, relevant=None):
+        """Returns the index of the next sledge for a comment of the author in the thread
+
+        :param size: number of sledges of the corpus
+        :param relevant: callable taking the accept predicate and returning a relevant index or None
+        """
+        keys = self.keys(thread, author)
+        used_sets = self._used_sets(keys, size)
+
+        def accept(index):
+            return not any(index in used for used in used_sets)
+
+        index = relevant(accept) if relevant is not None else None
+        if index is None:
+            index = self._draw(size, accept)
+        for key, used in zip(keys, used_sets):
+            used.add(index)
+            if self.store is not None:
+                self.store.save_bag(key, functools.partial(_used_state, size, used))
+        if self.store is not None and self.bag is not None:
+            self.store.save_bag(self.bag_key, self.bag.state)
+        return index
+
+
+def _used_state(size, used):
+    return {"size": size, "used": list(used)}
@@ -0,0 +1,73 @@
+import json
+import logging
+from project_dir.mc_bc_bot.utils.general_utilities import get_content_directory, WatchedFile
+from project_dir.mc_bc_bot.core.shedding import OVERFLOW_MODES, BLOCK
+
+# Minimum number of seconds between two checks of the modification time of settings.json
+SETTINGS_RELOAD_INTERVAL = 5.0
+
+logger = logging.getLogger(__name__)
+
+
+class Settings:
+    """The runtime configuration of the bot, read from the settings.json.
+    A new Settings is built whenever the file is modified, the running bot picks up the subreddits,
+    the undesirable authors and the reply budget without restarting. The consumers, the workers and
+    the overflow policy only apply when the bot starts
+
+    :param subreddits: names of the subreddits streamed
+    :param undesirable_authors: names of the authors never replied to
+    :param reply_rate: replies per second of an account, None for the default of the ReplyScheduler
+    :param reply_burst: number of replies which may be posted back to back
+    :param consumers: number of comments processed concurrently, None for the default of the pipeline
+    :param workers: number of processes between which the subreddits are split
+    :param overflow: what a full queue of the pipeline does: "block", "drop-oldest" or "priority"
+    :param max_age_minutes: age after which a comment is not answered anymore, None to answer them all
+    :param subreddit_priorities: dict of subreddit -> priority of its comments in the "priority" mode
+    :param poll_requests_per_minute: requests spent polling the subreddits, each at the cadence of its activity.
+        None to stream them all together with PRAW
+    """
+    def __init__(self, subreddits, undesirable_authors=(), reply_rate=None, reply_burst=None, consumers=None,
+                 workers=1, overflow=BLOCK, max_age_minutes=None, subreddit_priorities=None,
+                 poll_requests_per_minute=None):
+        if not subreddits or not all(isinstance(name, str) and name for name in subreddits):
+            raise ValueError(f"The subreddits must be a non-empty list of names, not {subreddits!r}")
+        if overflow not in OVERFLOW_MODES:
+            raise ValueError(f"The overflow must be one of {OVERFLOW_MODES}, not {overflow!r}")
+        self.subreddits = list(subreddits)
+        self.undesirable_authors = frozenset(author.lower() for author in undesirable_authors)
+        self.reply_rate = reply_rate
+        self.reply_burst = reply_burst
+        self.consumers = consumers
+        self.workers = workers
+        self.overflow = overflow
+        self.max_age_minutes = max_age_minutes
+        self.subreddit_priorities = dict(subreddit_priorities or {})
+        self.poll_requests_per_minute = poll_requests_per_minute
+
+    def poll_budget(self):
+        """Returns the requests per second spent polling the subreddits, None to stream them"""
+        if self.poll_requests_per_minute is None:
+            return None
+        return self.poll_requests_per_minute / 60
+
+    def subscription(self):
+        """Returns the key of the streamed subreddits, which does not depend on their order or case"""
+        return frozenset(name.lower() for name in self.subreddits)
+
+
+def load_settings(path):
+    """Parses the settings.json"""
+    with open(path, "r") as settings_file:
+        settings = Settings(**json.load(settings_file))
+    logger.info("Loaded the settings of %s subreddits from %s", len(settings.subreddits), path)
+    return settings
+
+
+_settings_file = WatchedFile(get_content_directory() / "settings.json", load_settings,
+                             interval=SETTINGS_RELOAD_INTERVAL)
+
+
+def get_settings():
+    """Returns the Settings of the current settings.json"""
+    return _settings_file.get()
@@ -0,0 +1,153 @@
+"""Bounded queues which drop the comments not worth answering anymore instead of growing without limit.
+
+During a burst, a full queue either makes the producer wait (BLOCK, the stream is then read more slowly),
+drops its oldest comment (DROP_OLDEST), or drops the oldest comment of the least important subreddit
+(PRIORITY). Whatever the mode, the comments older than the maximum age are dropped on the way in and out.
+"""
+import asyncio
+import collections
+import logging
+import time
+from project_dir.mc_bc_bot.core.metrics import METRICS, COMMENTS_SHED, COMMENTS_SHED_DESCRIPTION
+
+BLOCK = "block"
+DROP_OLDEST = "drop-oldest"
+PRIORITY = "priority"
+OVERFLOW_MODES = (BLOCK, DROP_OLDEST, PRIORITY)
+
+# Reasons for which a comment is dropped, labels of the shed counters
+OVERFLOW = "overflow"
+STALE = "stale"
+
+logger = logging.getLogger(__name__)
+
+
+class OverflowPolicy:
+    """What a full SheddingQueue does and which comments are too old to be answered
+
+    :param mode: BLOCK, DROP_OLDEST or PRIORITY
+    :param max_age: seconds after which a comment is dropped instead of being processed, None to keep them all
+    :param priorities: dict of subreddit -> priority for the PRIORITY mode. The comments of the higher priorities
+        are processed first and dropped last, the subreddits which are not listed have the priority 0
+    """
+    def __init__(self, mode=BLOCK, max_age=None, priorities=None):
+        if mode not in OVERFLOW_MODES:
+            raise ValueError(f"The overflow mode must be one of {OVERFLOW_MODES}, not {mode!r}")
+        self.mode = mode
+        self.max_age = max_age
+        self.priorities = {name.lower(): priority for name, priority in (priorities or {}).items()}
+
+    @classmethod
+    def from_settings(cls, settings):
+        max_age = settings.max_age_minutes * 60 if settings.max_age_minutes is not None else None
+        return cls(settings.overflow, max_age, settings.subreddit_priorities)
+
+    def priority(self, message):
+        if self.mode != PRIORITY or message.channel is None:
+            return 0
+        return self.priorities.get(message.channel.lower(), 0)
+
+    def is_stale(self, message, now):
+        return self.max_age is not None and now - message.created_at > self.max_age
+
+
+class _Backlog:
+    """The queued messages by priority, in order of arrival within each priority"""
+    def __init__(self):
+        self.deques = {}
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for priority in sorted(self.deques, reverse=True):
+            yield from self.deques[priority]
+
+    def append(self, priority, item):
+        deque = self.deques.get(priority)
+        if deque is None:
+            deque = self.deques[priority] = collections.deque()
+        deque.append(item)
+        self.size += 1
+
+    def _popleft(self, priority):
+        deque = self.deques[priority]
+        item = deque.popleft()
+        if not deque:
+            del self.deques[priority]
+        self.size -= 1
+        return item
+
+    def lowest_priority(self):
+        return min(self.deques)
+
+    def pop_first(self):
+        """Returns the oldest message of the highest priority"""
+        return self._popleft(max(self.deques))
+
+    def pop_least_important(self):
+        """Returns the oldest message of the lowest priority"""
+        return self._popleft(min(self.deques))
+
+
+class SheddingQueue(asyncio.Queue):
+    """An asyncio.Queue of Messages which applies an OverflowPolicy. Every dropped message is counted
+    under the name of the queue and handed to `on_shed`
+
+    :param maxsize: number of messages held, 0 for no limit
+    :param policy: the OverflowPolicy, by default the queue blocks when full and keeps the old messages
+    :param name: label of the queue in the metrics
+    :param on_shed: callable taking a dropped message and the reason, e.g. to mark it as seen
+    """
+    def __init__(self, maxsize=0, policy=None, name="ingest", on_shed=None):
+        self.policy = policy or OverflowPolicy()
+        self.name = name
+        self.on_shed = on_shed
+        self.shed_counters = {reason: METRICS.counter(COMMENTS_SHED, COMMENTS_SHED_DESCRIPTION,
+                                                      {"queue": name, "reason": reason})
+                              for reason in (OVERFLOW, STALE)}
+        super().__init__(maxsize)
+
+    def _init(self, maxsize):
+        self._queue = _Backlog()
+
+    def _put(self, item):
+        self._queue.append(self.policy.priority(item), item)
+
+    def _get(self):
+        return self._queue.pop_first()
+
+    def shed(self, item, reason, queued=False):
+        self.shed_counters[reason].inc()
+        logger.info("Dropped the comment %s of the %s queue: %s", item, self.name, reason,
+                    extra={"sample_rate": 100})
+        if queued:
+            self.task_done()
+        if self.on_shed is not None:
+            self.on_shed(item, reason)
+
+    async def put(self, item):
+        if self.policy.mode != BLOCK:
+            # Room is always made, the producer never waits
+            return self.put_nowait(item)
+        await super().put(item)
+
+    def put_nowait(self, item):
+        if self.policy.is_stale(item, time.time()):
+            self.shed(item, STALE)
+            return
+        if self.full() and self.policy.mode != BLOCK:
+            if self._queue.lowest_priority() > self.policy.priority(item):
+                self.shed(item, OVERFLOW)
+                return
+            self.shed(self._queue.pop_least_important(), OVERFLOW, queued=True)
+        super().put_nowait(item)
+
+    async def get(self):
+        """Returns the next message which is not too old, the older ones are dropped"""
+        while True:
+            item = await super().get()
+            if not self.policy.is_stale(item, time.time()):
+                return item
+            self.shed(item, STALE, queued=True)
@@ -0,0 +1,152 @@
+import json
+import mmap
+import os
+import struct
+import logging
+from project_dir.mc_bc_bot.utils.general_utilities import get_content_directory, get_artifacts_directory, \
+    WatchedFile
+
+# Minimum number of seconds between two checks of the modification times of sledges.json and of its compiled version
+SLEDGE_RELOAD_INTERVAL = 5.0
+
+# The compiled corpus: the header, then the offsets of every field of every sledge in the blob
+# (one more offset than fields, so that the field i ends where the field i + 1 starts), then the UTF-8 blob
+CORPUS_MAGIC = b"MCBCSLG1"
+CORPUS_HEADER = struct.Struct("<8sQ")
+CORPUS_OFFSET = struct.Struct("<Q")
+SLEDGE_FIELDS = 4
+
+logger = logging.getLogger(__name__)
+
+
+class Sledge:
+    """A single sledge with the people involved and the context in which it was said"""
+    __slots__ = ("quote", "perpetrator", "victim", "context")
+
+    def __init__(self, quote, perpetrator, victim, context):
+        self.quote = quote
+        self.perpetrator = perpetrator
+        self.victim = victim
+        self.context = context
+
+    def __repr__(self):
+        return f"Sledge({self.quote!r}, {self.perpetrator!r}, {self.victim!r})"
+
+
+class SledgeCorpus:
+    """Immutable collection of sledges stored in a tuple so that any of them can be picked in O(1)
+
+    :param sledges: iterable of Sledge
+    """
+    def __init__(self, sledges):
+        self.sledges = tuple(sledges)
+
+    @classmethod
+    def from_dict(cls, sledges_dict):
+        """Creates the corpus from the format of the sledges.json {quote: [perpetrator, victim, context]}"""
+        return cls(Sledge(quote, perp, victim, context) for quote, (perp, victim, context) in sledges_dict.items())
+
+    @classmethod
+    def from_json_file(cls, path):
+        with open(path, "r") as sledge_file:
+            corpus = cls.from_dict(json.load(sledge_file))
+        logger.info("Loaded %s sledges from %s", len(corpus), path)
+        return corpus
+
+    def __len__(self):
+        return len(self.sledges)
+
+    def __getitem__(self, index):
+        return self.sledges[index]
+
+    def __iter__(self):
+        return iter(self.sledges)
+
+    def to_dict(self):
+        """Returns the corpus in the format of the sledges.json"""
+        return {sledge.quote: [sledge.perpetrator, sledge.victim, sledge.context] for sledge in self.sledges}
+
+
+def get_compiled_corpus_path():
+    """Returns the path of the compiled sledges.json"""
+    return get_artifacts_directory() / "sledges.bin"
+
+
+def compile_corpus(corpus, path):
+    """Writes the corpus in the binary format read by MappedSledgeCorpus, replacing the file atomically"""
+    offsets = [0]
+    fields = []
+    for sledge in corpus:
+        for field in (sledge.quote, sledge.perpetrator, sledge.victim, sledge.context):
+            encoded = field.encode("utf-8")
+            fields.append(encoded)
+            offsets.append(offsets[-1] + len(encoded))
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "wb") as corpus_file:
+        corpus_file.write(CORPUS_HEADER.pack(CORPUS_MAGIC, len(corpus)))
+        corpus_file.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+        corpus_file.writelines(fields)
+    os.replace(temporary_path, path)
+    logger.info("Compiled %s sledges into %s", len(corpus), path)
+
+
+class MappedSledgeCorpus:
+    """Read-only corpus memory-mapped from the file written by compile_corpus. Nothing is parsed when it is
+    opened and only the sledges which are accessed are decoded. The worker processes mapping the same file
+    share its pages. Behaves like a SledgeCorpus
+
+    :param path: path of the compiled corpus
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as corpus_file:
+            self.buffer = mmap.mmap(corpus_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = CORPUS_HEADER.unpack_from(self.buffer, 0)
+        if magic != CORPUS_MAGIC:
+            raise ValueError(f"{path} is not a compiled corpus")
+        self.offsets_start = CORPUS_HEADER.size
+        self.blob_start = self.offsets_start + (self.count * SLEDGE_FIELDS + 1) * CORPUS_OFFSET.size
+        logger.info("Mapped %s sledges from %s", self.count, path)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("sledge index out of range")
+        first = index * SLEDGE_FIELDS
+        offsets = struct.unpack_from(f"<{SLEDGE_FIELDS + 1}Q", self.buffer,
+                                     self.offsets_start + first * CORPUS_OFFSET.size)
+        fields = [str(self.buffer[self.blob_start + start:self.blob_start + end], "utf-8")
+                  for start, end in zip(offsets, offsets[1:])]
+        return Sledge(*fields)
+
+    def __iter__(self):
+        return (self[index] for index in range(self.count))
+
+    def to_dict(self):
+        """Returns the corpus in the format of the sledges.json"""
+        return SledgeCorpus(self).to_dict()
+
+
+def load_sledge_corpus(path):
+    """Maps the compiled corpus when it is at least as recent as the json, parses the json otherwise"""
+    compiled_path = get_compiled_corpus_path()
+    try:
+        if os.stat(compiled_path).st_mtime_ns >= os.stat(path).st_mtime_ns:
+            return MappedSledgeCorpus(compiled_path)
+    except FileNotFoundError:
+        pass
+    return SledgeCorpus.from_json_file(path)
+
+
+# A new compiled corpus is mapped as soon as it is written, the old mapping stays valid until it is released
+_corpus_file = WatchedFile(get_content_directory() / "sledges.json", load_sledge_corpus,
+                           interval=SLEDGE_RELOAD_INTERVAL, dependencies=[get_compiled_corpus_path()])
+
+
+def get_sledge_corpus():
+    """Returns the corpus loaded from the current sledges.json, or mapped from its compiled version"""
+    return _corpus_file.get()
@@ -0,0 +1,244 @@
+import asyncio
+import heapq
+import json
+import logging
+import sqlite3
+import threading
+import time
+from project_dir.mc_bc_bot.utils.general_utilities import get_artifacts_directory, run_blocking
+
+# Number of seconds between two writes of the pending changes
+FLUSH_INTERVAL = 5.0
+# Number of pending changes after which they are written without waiting for the interval
+FLUSH_SIZE = 100
+# Number of days after which a processed comment is forgotten
+RETENTION_DAYS = 7
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS processed_comments (id TEXT PRIMARY KEY, processed_at REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS checkpoints (subreddit TEXT PRIMARY KEY, fullname TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS excluded_authors (author TEXT PRIMARY KEY, excluded_at REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS backfilled_submissions (id TEXT PRIMARY KEY, backfilled_at REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS shuffle_bags (key TEXT PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL);
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def get_store_path():
+    """Returns the path of the sqlite database of the bot"""
+    return get_artifacts_directory() / "mc_bc_bot.sqlite3"
+
+
+def comment_number(fullname):
+    """Returns the number of the comment id. Reddit ids are increasing base-36 numbers"""
+    return int(fullname.rsplit("_", 1)[-1], 36)
+
+
+class BotStore:
+    """Remembers what the bot already processed so that a restart resumes where it stopped.
+
+    Lookups only hit the in-memory sets, the database is written in batches.
+    Several worker processes may share the same database.
+    Only the comments which matched a trigger are recorded: the others are cheap to match again
+    and are skipped anyway by the per-subreddit checkpoint.
+
+    :param path: path of the sqlite database, ":memory:" for a throw-away store
+    """
+    def __init__(self, path=None):
+        self.path = str(path or get_store_path())
+        self.connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.executescript(SCHEMA)
+            self.connection.execute("DELETE FROM processed_comments WHERE processed_at < ?",
+                                    (time.time() - RETENTION_DAYS * 86400,))
+        self.processed = {row[0] for row in self.connection.execute("SELECT id FROM processed_comments")}
+        self.checkpoints = dict(self.connection.execute("SELECT subreddit, fullname FROM checkpoints"))
+        self.excluded = set(self.read_exclusions())
+        self.backfilled = {row[0] for row in self.connection.execute("SELECT id FROM backfilled_submissions")}
+        self.pending_processed = []
+        self.dirty_checkpoints = set()
+        self.pending_authors = {}
+        self.pending_bags = {}
+        self.pending_backfilled = []
+        logger.info("Opened %s with %s processed comments, %s checkpoints and %s excluded authors",
+                    self.path, len(self.processed), len(self.checkpoints), len(self.excluded))
+
+    def is_processed(self, comment_id):
+        return comment_id in self.processed
+
+    def is_before_checkpoint(self, subreddit, fullname):
+        """Returns True if the comment is not newer than the last comment seen in the subreddit"""
+        checkpoint = self.checkpoints.get(subreddit.lower())
+        return checkpoint is not None and comment_number(fullname) <= comment_number(checkpoint)
+
+    def checkpoint(self, subreddit):
+        """Returns the fullname of the last comment seen in the subreddit, None if nothing was seen yet"""
+        return self.checkpoints.get(subreddit.lower())
+
+    def advance_checkpoint(self, subreddit, fullname):
+        subreddit = subreddit.lower()
+        if self.is_before_checkpoint(subreddit, fullname):
+            return
+        self.checkpoints[subreddit] = fullname
+        self.dirty_checkpoints.add(subreddit)
+
+    def mark_processed(self, comment_id):
+        if comment_id in self.processed:
+            return
+        self.processed.add(comment_id)
+        self.pending_processed.append((comment_id, time.time()))
+
+    def is_backfilled(self, submission_id):
+        return submission_id in self.backfilled
+
+    def mark_backfilled(self, submission_id):
+        """Records that every comment of the submission went through the backfill"""
+        if submission_id in self.backfilled:
+            return
+        self.backfilled.add(submission_id)
+        self.pending_backfilled.append((submission_id, time.time()))
+
+    def is_excluded(self, author):
+        """Returns True if the author opted out of the replies of the bot. Reddit names are case-insensitive"""
+        return author.lower() in self.excluded
+
+    def exclude(self, author):
+        author = author.lower()
+        self.excluded.add(author)
+        self.pending_authors[author] = True
+
+    def include(self, author):
+        author = author.lower()
+        self.excluded.discard(author)
+        self.pending_authors[author] = False
+
+    def read_exclusions(self):
+        """Returns the excluded authors of the database, including those written by the other workers"""
+        with self.lock:
+            return [row[0] for row in self.connection.execute("SELECT author FROM excluded_authors")]
+
+    def update_exclusions(self, authors):
+        """Replaces the excluded authors with those read from the database, keeping the changes not written yet.
+        Must be called from the thread updating the store"""
+        excluded = set(authors)
+        for author, is_excluded in self.pending_authors.items():
+            if is_excluded:
+                excluded.add(author)
+            else:
+                excluded.discard(author)
+        self.excluded = excluded
+
+    def load_bags(self, limit):
+        """Returns the `limit` most recently saved shuffle bags, the most recent first, and deletes the others"""
+        with self.lock, self.connection:
+            rows = self.connection.execute("SELECT key, state FROM shuffle_bags ORDER BY updated_at DESC LIMIT ?",
+                                           (limit,)).fetchall()
+            if len(rows) == limit:
+                self.connection.execute("DELETE FROM shuffle_bags WHERE key NOT IN "
+                                        "(SELECT key FROM shuffle_bags ORDER BY updated_at DESC LIMIT ?)", (limit,))
+        return {key: json.loads(state) for key, state in rows}
+
+    def save_bag(self, key, state):
+        """Saves the state of a shuffle bag with the next batch
+
+        :param state: function returning the JSON serializable state, only called once per batch
+        """
+        self.pending_bags[key] = state
+
+    def forget_bag(self, key):
+        self.pending_bags[key] = None
+
+    @property
+    def pending(self):
+        return len(self.pending_processed) + len(self.dirty_checkpoints) + \
+            len(self.pending_authors) + len(self.pending_bags) + len(self.pending_backfilled)
+
+    def take_pending(self):
+        """Returns the pending changes and forgets them. Must be called from the thread updating the store"""
+        batch = (self.pending_processed,
+                 [(subreddit, self.checkpoints[subreddit]) for subreddit in self.dirty_checkpoints],
+                 self.pending_authors, {key: state and state() for key, state in self.pending_bags.items()},
+                 self.pending_backfilled)
+        self.pending_processed, self.dirty_checkpoints = [], set()
+        self.pending_authors, self.pending_bags, self.pending_backfilled = {}, {}, []
+        return batch
+
+    def write(self, batch):
+        """Writes the changes returned by take_pending in a single transaction.
+        Returns the excluded authors read back in that transaction, those written by the other workers included,
+        so that no change taken from the store is missing from them"""
+        processed, checkpoints, authors, bags, backfilled = batch
+        if not (processed or checkpoints or authors or bags or backfilled):
+            return self.read_exclusions()
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR IGNORE INTO processed_comments VALUES (?, ?)", processed)
+            self.connection.executemany("INSERT OR REPLACE INTO checkpoints VALUES (?, ?)", checkpoints)
+            self.connection.executemany("INSERT OR IGNORE INTO excluded_authors VALUES (?, ?)",
+                                        [(author, now) for author, excluded in authors.items() if excluded])
+            self.connection.executemany("DELETE FROM excluded_authors WHERE author = ?",
+                                        [(author,) for author, excluded in authors.items() if not excluded])
+            self.connection.executemany("INSERT OR REPLACE INTO shuffle_bags VALUES (?, ?, ?)",
+                                        [(key, json.dumps(state), now) for key, state in bags.items()
+                                         if state is not None])
+            self.connection.executemany("DELETE FROM shuffle_bags WHERE key = ?",
+                                        [(key,) for key, state in bags.items() if state is None])
+            self.connection.executemany("INSERT OR IGNORE INTO backfilled_submissions VALUES (?, ?)", backfilled)
+            return [row[0] for row in self.connection.execute("SELECT author FROM excluded_authors")]
+
+    def flush(self):
+        self.write(self.take_pending())
+
+    async def run_flusher(self, interval=FLUSH_INTERVAL):
+        """Writes the pending changes every `interval` seconds, or sooner when FLUSH_SIZE of them pile up,
+        and reloads the exclusions of the other workers sharing the database"""
+        while True:
+            deadline = time.monotonic() + interval
+            while self.pending < FLUSH_SIZE and time.monotonic() < deadline:
+                await asyncio.sleep(min(1.0, interval))
+            self.update_exclusions(await run_blocking(self.write, self.take_pending()))
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.connection.close()
+
+
+class CheckpointTracker:
+    """Advances the checkpoints of the store past the comments which are done with only.
+    A comment still in the pipeline, queued, being validated or waiting for its reply, holds the checkpoint of its
+    subreddit below it. The newer comments done meanwhile move it once the comment is done with
+
+    :param store: the BotStore whose checkpoints are advanced
+    """
+    def __init__(self, store):
+        self.store = store
+        # subreddit -> {comment number: fullname} of the comments still in the pipeline
+        self.held = {}
+        # subreddit -> heap of the (comment number, fullname) done but newer than a held comment
+        self.done = {}
+
+    def hold(self, subreddit, fullname):
+        self.held.setdefault(subreddit.lower(), {})[comment_number(fullname)] = fullname
+
+    def release(self, subreddit, fullname):
+        """The comment is done with, the checkpoint moves to the newest comment older than every held one"""
+        subreddit = subreddit.lower()
+        held = self.held.get(subreddit, {})
+        held.pop(comment_number(fullname), None)
+        if not held:
+            self.held.pop(subreddit, None)
+        done = self.done.setdefault(subreddit, [])
+        heapq.heappush(done, (comment_number(fullname), fullname))
+        oldest_held = min(held) if held else None
+        newest = None
+        while done and (oldest_held is None or done[0][0] < oldest_held):
+            newest = heapq.heappop(done)[1]
+        if not done:
+            del self.done[subreddit]
+        if newest is not None:
+            self.store.advance_checkpoint(subreddit, newest)
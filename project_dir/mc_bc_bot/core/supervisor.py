@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from prawcore.exceptions import RequestException, ResponseException, ServerError
+from project_dir.mc_bc_bot.core.metrics import RECONNECTS
+
+# Seconds waited before the first reconnection
+BACKOFF_BASE = 1.0
+# Maximum number of seconds waited between two reconnections
+BACKOFF_CAP = 300.0
+# A stream which ran at least this many seconds was healthy, the backoff starts again from the base
+HEALTHY_STREAM_SECONDS = 60.0
+
+logger = logging.getLogger(__name__)
+
+
+def is_transient_error(error):
+    """Returns True for the errors after which reconnecting may help: network failures, time-outs,
+    reddit's server errors and rate limiting. Anything else (bad credentials, banned or missing
+    subreddits...) will not get better by retrying"""
+    if isinstance(error, (RequestException, ServerError)):
+        return True
+    if isinstance(error, ResponseException):
+        status_code = error.response.status_code
+        return status_code in (408, 429) or status_code >= 500
+    return False
+
+
+class ExponentialBackoff:
+    """Doubles the delay after every failure up to `cap`. Half of the delay is random so that
+    several bots do not reconnect at the same instant
+
+    :param base: the first delay in seconds
+    :param cap: the maximum delay in seconds
+    """
+    def __init__(self, base=BACKOFF_BASE, cap=BACKOFF_CAP, rng=random):
+        self.base = base
+        self.cap = cap
+        self.rng = rng
+        self.attempt = 0
+
+    def next_delay(self):
+        delay = min(self.cap, self.base * 2 ** self.attempt)
+        self.attempt = min(self.attempt + 1, 32)
+        return delay / 2 + self.rng.uniform(0, delay / 2)
+
+    def reset(self):
+        self.attempt = 0
+
+
+def produce_comments(comment_stream, loop, put, stop_event):
+    """Pulls comments from the blocking PRAW stream and hands them over to the event loop.
+    Runs in its own thread. Blocks when the queue is full so that the stream is not read faster than it is processed.
+    A stream may yield None when it has nothing new, it is then stopped if it should be
+
+    :param put: coroutine function queueing a comment, run in the event loop
+    """
+    for comment in comment_stream:
+        if stop_event.is_set():
+            return
+        if comment is None:
+            continue
+        asyncio.run_coroutine_threadsafe(put(comment), loop).result()
+
+
+class StreamSupervisor:
+    """Owns the lifecycle of the comment stream. The stream is read in its own thread and created
+    again, after a backoff, whenever it fails with a transient error.
+    The new stream starts with the latest comments, which are filtered with the checkpoints of the store.
+    `restart` replaces the stream by a new one from the factory, e.g. when the subreddits changed.
+
+    :param stream_factory: callable returning a new PRAW comment stream
+    :param queue: the asyncio.Queue receiving the comments
+    :param backoff: the ExponentialBackoff between reconnections
+    :param admit: callable taking a comment before it is queued, from the event loop. Returns False to drop it,
+        e.g. when a new stream yields again a comment which is still in the pipeline
+    """
+    def __init__(self, stream_factory, queue, backoff=None, admit=None):
+        self.stream_factory = stream_factory
+        self.queue = queue
+        self.admit = admit
+        self.backoff = backoff or ExponentialBackoff()
+        self.reconnects = 0
+        self.stop_event = threading.Event()
+        self.restarted = None
+
+    async def put(self, comment):
+        if self.admit is None or self.admit(comment) is not False:
+            await self.queue.put(comment)
+
+    def restart(self):
+        """Starts a new stream straight away. The thread of the old one stops at its next comment"""
+        if self.restarted is not None:
+            self.restarted.set()
+
+    async def read_stream(self, loop):
+        """Reads a stream in its own thread until it is exhausted, fails or is restarted.
+        Returns True if it was restarted"""
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="comment-stream")
+        reading = loop.run_in_executor(executor, produce_comments, self.stream_factory(), loop, self.put,
+                                       self.stop_event)
+        restarted = asyncio.ensure_future(self.restarted.wait())
+        try:
+            await asyncio.wait([reading, restarted], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            restarted.cancel()
+            if not reading.done():
+                # The old thread is left to stop on its own, whatever it raises meanwhile is of no interest
+                reading.add_done_callback(lambda future: future.cancelled() or future.exception())
+                self.stop_event.set()
+                self.stop_event = threading.Event()
+            executor.shutdown(wait=False)
+        if not reading.done():
+            self.restarted.clear()
+            logger.info("Restarted the comment stream")
+            return True
+        reading.result()
+        return False
+
+    async def run(self):
+        """Reads the stream until it is exhausted. Raises the errors which are not transient"""
+        loop = asyncio.get_event_loop()
+        self.restarted = asyncio.Event()
+        try:
+            while True:
+                started_at = time.monotonic()
+                try:
+                    if not await self.read_stream(loop):
+                        return
+                except Exception as e:
+                    if not is_transient_error(e):
+                        logger.error("The comment stream failed with %r which cannot be recovered", e)
+                        raise
+                    if time.monotonic() - started_at > HEALTHY_STREAM_SECONDS:
+                        self.backoff.reset()
+                    delay = self.backoff.next_delay()
+                    self.reconnects += 1
+                    RECONNECTS.inc()
+                    logger.warning("The comment stream failed with %r, reconnecting in %.1f seconds", e, delay)
+                    await asyncio.sleep(delay)
+        finally:
+            self.stop_event.set()
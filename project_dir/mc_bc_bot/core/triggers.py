@@ -0,0 +1,94 @@
+import json
+import re
+import unicodedata
+import logging
+from project_dir.mc_bc_bot.utils.general_utilities import get_content_directory, WatchedFile
+
+# Minimum number of seconds between two checks of the modification time of triggers.json
+TRIGGER_RELOAD_INTERVAL = 1.0
+# Up to this many triggers, plain substring scans are faster than the compiled expression
+SUBSTRING_SCAN_LIMIT = 16
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text):
+    """Folds the text so that visually identical strings compare equal (NFKC + casefold)"""
+    return unicodedata.normalize("NFKC", text).casefold()
+
+
+def _trie_pattern(words):
+    """Builds a regular expression out of the words in which the common prefixes are shared.
+    Similar to an Aho-Corasick automaton, every character of the text is then only compared against
+    the branches of the trie instead of against every single word"""
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def to_pattern(node):
+        terminal = "" in node
+        branches = [re.escape(char) + to_pattern(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        if len(branches) == 1 and not terminal:
+            return branches[0]
+        pattern = "(?:" + "|".join(branches) + ")"
+        return pattern + "?" if terminal else pattern
+
+    return to_pattern(trie)
+
+
+class TriggerMatcher:
+    """Matches a text against all the triggers in a single pass over the text
+
+    :param triggers: iterable of the trigger strings
+    :param word_boundary: True if a trigger should only match as a whole word
+    :param normalize: True if the text and triggers are NFKC normalized and casefolded instead of lower-cased
+    """
+    def __init__(self, triggers, word_boundary=False, normalize=False):
+        self.word_boundary = word_boundary
+        self.normalize = normalize
+        fold = normalize_text if normalize else str.lower
+        self.triggers = sorted({fold(trigger) for trigger in triggers if trigger})
+        self._fold = fold
+        self._search = None
+        if not self.triggers or (not word_boundary and len(self.triggers) <= SUBSTRING_SCAN_LIMIT):
+            return
+        pattern = _trie_pattern(self.triggers)
+        if word_boundary:
+            pattern = r"(?<!\w)" + pattern + r"(?!\w)"
+        self._search = re.compile(pattern).search
+
+    def matches(self, text):
+        """Returns True if any of the triggers is present in the text"""
+        text = self._fold(text)
+        if self._search is None:
+            return any(trigger in text for trigger in self.triggers)
+        return self._search(text) is not None
+
+
+def build_trigger_matcher(triggers_json):
+    """Builds the matcher from the parsed content of the triggers.json"""
+    return TriggerMatcher(triggers_json['triggered_by'],
+                          word_boundary=triggers_json.get('word_boundary', False),
+                          normalize=triggers_json.get('normalize', False))
+
+
+def load_trigger_matcher(path):
+    """Parses the triggers.json and compiles its triggers"""
+    with open(path, "r") as triggers:
+        matcher = build_trigger_matcher(json.load(triggers))
+    logger.info("Compiled %s triggers from %s", len(matcher.triggers), path)
+    return matcher
+
+
+_matcher_file = WatchedFile(get_content_directory() / "triggers.json", load_trigger_matcher,
+                            interval=TRIGGER_RELOAD_INTERVAL)
+
+
+def get_trigger_matcher():
+    """Returns the matcher compiled from the current triggers.json"""
+    return _matcher_file.get()
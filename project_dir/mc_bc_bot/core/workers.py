@@ -0,0 +1,88 @@
+import asyncio
+import itertools
+import logging
+import multiprocessing
+from project_dir.mc_bc_bot.utils.general_utilities import init_logger
+
+# The praw.ini section used when no account is given
+DEFAULT_ACCOUNT = 'mc_bc_bot'
+
+logger = logging.getLogger(__name__)
+
+
+def shard_subreddits(subreddits, worker_count):
+    """Splits the subreddits round-robin into at most `worker_count` non-empty shards"""
+    shards = [subreddits[index::worker_count] for index in range(worker_count)]
+    return [shard for shard in shards if shard]
+
+
+def assign_accounts(shard_count, accounts):
+    """Returns the account of every shard and the share of the reply budget of that account it may use"""
+    accounts = list(accounts or [DEFAULT_ACCOUNT])
+    assigned = list(itertools.islice(itertools.cycle(accounts), shard_count))
+    return [(account, 1 / assigned.count(account)) for account in assigned]
+
+
+def run_worker(account, subreddits, consumers, budget_share, log_options=None, metrics_port=None, metrics_file=None,
+               network_options=None):
+    """Entry point of a worker process: streams its own subreddits with its own account and reply budget.
+    The dedupe state is shared with the other workers through the sqlite store"""
+    # Imported here so that the coordinator does not need the network stack
+    from project_dir.mc_bc_bot.core.reddit import get_reddit_object, get_blocking_executor, comment_reply_maker, \
+        POOL_SIZE
+    from project_dir.mc_bc_bot.core.scheduler import TokenBucket, DEFAULT_REPLY_RATE, DEFAULT_REPLY_BURST
+    from project_dir.mc_bc_bot.core.settings import get_settings
+    from project_dir.mc_bc_bot.core.shedding import OverflowPolicy
+    from project_dir.mc_bc_bot.core.metrics import start_metrics_server, dump_metrics_periodically
+    if log_options is not None:
+        init_logger(**log_options)
+    if metrics_port is not None:
+        start_metrics_server(metrics_port)
+    logger.info("Worker with the account %s streams %s", account, subreddits)
+    network_options = network_options or {}
+    reddit = get_reddit_object(account, **network_options)
+    settings = get_settings()
+    bucket = TokenBucket(rate=(settings.reply_rate or DEFAULT_REPLY_RATE) * budget_share,
+                         capacity=settings.reply_burst or DEFAULT_REPLY_BURST)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.set_default_executor(get_blocking_executor(network_options.get("pool_size", POOL_SIZE)))
+    if metrics_file is not None:
+        loop.create_task(dump_metrics_periodically(metrics_file))
+    loop.run_until_complete(comment_reply_maker(reddit.subreddit("+".join(subreddits)),
+                                                consumers=consumers, bucket=bucket,
+                                                overflow=OverflowPolicy.from_settings(settings),
+                                                poll_budget=settings.poll_budget(),
+                                                name=multiprocessing.current_process().name))
+
+
+def run_workers(worker_count, subreddits, consumers, accounts=None, log_options=None, metrics_port=None,
+                metrics_file=None, network_options=None):
+    """Starts one process per shard of the subreddits and waits for all of them.
+    Each worker serves its metrics on `metrics_port` + its index and dumps them to `metrics_file`.<index>
+
+    :param worker_count: number of worker processes
+    :param subreddits: list of the subreddits to split between the workers
+    :param consumers: number of concurrent consumers in each worker
+    :param accounts: list of praw.ini sections, assigned round-robin to the workers
+    :param log_options: keyword arguments of init_logger for the workers, None to not configure the logs
+    :param network_options: keyword arguments of get_reddit_object for the workers
+    :return: 0 if every worker exited cleanly, 1 otherwise
+    """
+    context = multiprocessing.get_context("spawn")
+    shards = shard_subreddits(subreddits, worker_count)
+    processes = []
+    for index, (shard, (account, share)) in enumerate(zip(shards, assign_accounts(len(shards), accounts))):
+        process = context.Process(target=run_worker, name=f"mc_bc_bot-worker-{index}",
+                                  args=(account, shard, consumers, share, log_options,
+                                        None if metrics_port is None else metrics_port + index,
+                                        None if metrics_file is None else f"{metrics_file}.{index}",
+                                        network_options))
+        process.start()
+        processes.append(process)
+    logger.info("Started %s workers", len(processes))
+    for process in processes:
+        process.join()
+        if process.exitcode != 0:
+            logger.error("%s exited with the code %s", process.name, process.exitcode)
+    return 0 if all(process.exitcode == 0 for process in processes) else 1
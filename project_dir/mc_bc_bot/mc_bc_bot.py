@@ -1,28 +1,126 @@
-import asyncio
-from project_dir.mc_bc_bot.utils.general_utilities import get_argument_parser, init_logger
-from project_dir.mc_bc_bot.core.reddit import get_reddit_object, SUBREDDITS, comment_reply_maker
+from project_dir.mc_bc_bot.utils.general_utilities import get_argument_parser, init_logger, run_blocking
 from project_dir.mc_bc_bot.version import __version__
 import sys
 import logging
 
+# The reddit modules pull praw, prawcore and requests. They are imported by the modes which need
+# them so that --version and the health probes start instantly
 
 logger = logging.getLogger(__name__)
 
 
-async def main(reddit=None, twitter=None, version=None, verbose=None):
-    if verbose is True:
-        logger = init_logger(verbose=True)
-    if reddit is True:
-        reddit_object = get_reddit_object()
-        required_subreddits = reddit_object.subreddit("+".join(SUBREDDITS))
-        await comment_reply_maker(required_subreddits)
+def get_log_options(arguments):
+    """Returns the keyword arguments of init_logger given on the command line, None if the logs are not configured"""
+    if not (arguments.verbose or arguments.async_logging):
+        return None
+    return {"asynchronous": arguments.async_logging, "max_bytes": arguments.log_max_bytes,
+            "backup_count": arguments.log_backups}
 
-    if twitter is True:
-        NotImplementedError
+
+def get_network_options(arguments):
+    """Returns the keyword arguments of get_reddit_object given on the command line"""
+    return {"pool_size": arguments.pool_size, "connect_timeout": arguments.connect_timeout,
+            "read_timeout": arguments.read_timeout}
+
+
+def use_blocking_executor(network_options):
+    """Runs the blocking calls of the event loop in as many threads as there are pooled connections"""
+    import asyncio
+    from project_dir.mc_bc_bot.core.reddit import get_blocking_executor, POOL_SIZE
+    pool_size = network_options.get("pool_size", POOL_SIZE)
+    asyncio.get_event_loop().set_default_executor(get_blocking_executor(pool_size))
+
+
+def print_version():
+    logger.info(__version__)
+    print(__version__)
+
+
+def get_backfill_options(arguments):
+    """Returns the options of the backfill given on the command line, None if it was not asked for"""
+    if not arguments.backfill:
+        return None
+    if arguments.since is None and arguments.submissions is None:
+        raise SystemExit("The backfill needs --since or --submissions")
+    return {"subreddits": arguments.subreddits.split(",") if arguments.subreddits else None,
+            "since": arguments.since, "until": arguments.until,
+            "submission_ids": arguments.submissions.split(",") if arguments.submissions else (),
+            "replace_more": arguments.replace_more, "concurrency": arguments.backfill_concurrency,
+            "plan": arguments.plan}
+
+
+async def run_backfill(consumers, accounts, subreddits=None, plan=None, network_options=None, **options):
+    """Runs the comments of past submissions through the pipeline, the replies are posted or planned"""
+    from project_dir.mc_bc_bot.core.reddit import get_reddit_object
+    from project_dir.mc_bc_bot.core.settings import get_settings
+    from project_dir.mc_bc_bot.core.pipeline import Pipeline, CONSUMER_COUNT
+    from project_dir.mc_bc_bot.core.store import BotStore
+    from project_dir.mc_bc_bot.core.backfill import BackfillAdapter
+    network_options = network_options or {}
+    use_blocking_executor(network_options)
+    reddit_object = get_reddit_object(accounts.split(",")[0] if accounts else 'mc_bc_bot', **network_options)
+    store = BotStore()
+    plan_file = open(plan, "a", encoding="utf-8") if plan is not None else None
+    try:
+        settings = get_settings()
+        adapter = BackfillAdapter(reddit_object, store, subreddits or settings.subreddits, plan=plan_file, **options)
+        await Pipeline([adapter], store, consumers or settings.consumers or CONSUMER_COUNT, name="backfill").run()
+    finally:
+        if plan_file is not None:
+            plan_file.close()
+
+
+async def main(reddit=None, version=None, verbose=None, consumers=None, workers=None, accounts=None,
+               metrics_port=None, metrics_file=None, log_options=None, local=None, local_port=None, backfill=None,
+               network_options=None):
+    if verbose is True and log_options is None:
+        log_options = {}
+    if log_options is not None:
+        log_options = dict(log_options, verbose=bool(verbose))
+        init_logger(**log_options)
+    network_options = network_options or {}
+    # The settings.json gives the subreddits, and the numbers of consumers and workers not given on the command line
+    from project_dir.mc_bc_bot.core.settings import get_settings
+    settings = get_settings()
+    workers = workers or settings.workers
+    if backfill is not None:
+        await run_backfill(consumers, accounts, network_options=network_options, **backfill)
+    elif reddit is True and workers > 1:
+        from project_dir.mc_bc_bot.core.pipeline import CONSUMER_COUNT
+        from project_dir.mc_bc_bot.core.workers import run_workers
+        await run_blocking(run_workers, workers, settings.subreddits,
+                           consumers or settings.consumers or CONSUMER_COUNT,
+                           accounts.split(",") if accounts else None, log_options, metrics_port, metrics_file,
+                           network_options)
+    elif reddit is True or local is not None or local_port is not None:
+        # All the platforms share the same pipeline and event loop
+        import asyncio
+        from project_dir.mc_bc_bot.core.pipeline import Pipeline, CONSUMER_COUNT
+        from project_dir.mc_bc_bot.core.store import BotStore
+        from project_dir.mc_bc_bot.core.shedding import OverflowPolicy
+        from project_dir.mc_bc_bot.core.metrics import start_metrics_server, dump_metrics_periodically
+        if metrics_port is not None:
+            start_metrics_server(metrics_port)
+        if metrics_file is not None:
+            asyncio.ensure_future(dump_metrics_periodically(metrics_file))
+        store = BotStore()
+        adapters = []
+        if reddit is True:
+            from project_dir.mc_bc_bot.core.reddit import get_reddit_object, RedditAdapter
+            use_blocking_executor(network_options)
+            reddit_object = get_reddit_object(accounts.split(",")[0] if accounts else 'mc_bc_bot',
+                                              **network_options)
+            adapters.append(RedditAdapter(reddit_object.subreddit("+".join(settings.subreddits)), store,
+                                          follow_settings=True))
+        if local is not None or local_port is not None:
+            from project_dir.mc_bc_bot.core.local import LocalAdapter
+            adapters.append(LocalAdapter(path=local, port=local_port))
+        # The backfill answers old comments on purpose, only the live sources drop them
+        await Pipeline(adapters, store, consumers or settings.consumers or CONSUMER_COUNT,
+                       OverflowPolicy.from_settings(settings)).run()
 
     if version is True:
-        logger.info(__version__)
-        print(__version__)
+        print_version()
 
 if __name__ == "__main__":
     import time
@@ -32,16 +130,34 @@ if __name__ == "__main__":
     argument_parser = get_argument_parser()
     # Parse only arguments from 1 (strip the 0 which is the script name)
     arguments = argument_parser.parse_args(sys.argv[1:])
+    if arguments.twitter is True:
+        argument_parser.error("--twitter is not implemented yet, there is no twitter adapter")
 
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(main(
-        reddit=arguments.reddit,
-        twitter=arguments.twitter,
-        version=arguments.version,
-        verbose=arguments.verbose
-    ))
+    if arguments.reddit is True or arguments.local is not None or \
+            arguments.local_port is not None or arguments.backfill is True:
+        import asyncio
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(main(
+            reddit=arguments.reddit,
+            version=arguments.version,
+            verbose=arguments.verbose,
+            consumers=arguments.consumers,
+            workers=arguments.workers,
+            accounts=arguments.accounts,
+            metrics_port=arguments.metrics_port,
+            metrics_file=arguments.metrics_file,
+            log_options=get_log_options(arguments),
+            local=arguments.local,
+            local_port=arguments.local_port,
+            backfill=get_backfill_options(arguments),
+            network_options=get_network_options(arguments)
+        ))
+    elif arguments.version is True:
+        # Nothing asynchronous to run, the event loop is not even imported
+        log_options = get_log_options(arguments)
+        if log_options is not None:
+            init_logger(verbose=arguments.verbose, **log_options)
+        print_version()
 
     elapsed = time.perf_counter() - s
     print(f"{__file__} executed in {elapsed:0.2f} seconds.")
-
-
@@ -1,11 +1,16 @@
 import argparse
+import atexit
 import logging
+import os
+import queue
+import re
 import sys
 import pathlib
-import cachetools
-from logging.handlers import RotatingFileHandler
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
-cache = cachetools.TTLCache(maxsize=100, ttl=3600)
+logger = logging.getLogger(__name__)
 
 
 def get_argument_parser():
@@ -14,50 +19,264 @@ def get_argument_parser():
     reddit_help = "Starts the bot on reddit"
     twitter_help = "Twitter bot shall be initialied with this, but is currently not implemented"
     version_help = "Prints the version of the language installer"
+    backfill_help = "Replies to the comments of past submissions instead of streaming the new ones"
+    subreddits_help = "Comma separated subreddits whose submissions are backfilled, those of the bot by default"
+    since_help = "Oldest submission backfilled: ISO date, UNIX timestamp, or a number of hours ago such as 24h"
+    until_help = "Newest submission backfilled, in the same formats as --since. Now by default"
+    submissions_help = "Comma separated ids of the submissions backfilled instead of those of the time window"
+    replace_more_help = "Number of 'load more comments' expanded per backfilled submission"
+    backfill_concurrency_help = "Number of submissions expanded concurrently"
+    plan_help = "Writes the replies of the backfill as JSON lines in this file instead of posting them"
+    local_help = "Replies to the messages of this JSON lines file, - for the standard input"
+    local_port_help = "Replies to the messages received on this local TCP port"
+    consumers_help = "Number of comments that are processed concurrently, that of the settings.json by default"
+    workers_help = "Number of processes between which the subreddits are split, that of the settings.json by default"
+    accounts_help = "Comma separated sections of the praw.ini, assigned round-robin to the workers"
+    metrics_port_help = "Serves the metrics in the Prometheus text format on this local port"
+    metrics_file_help = "Dumps the metrics as JSON in this file every minute"
+    async_logging_help = "Writes the logs from a background thread"
+    log_max_bytes_help = "Size in bytes of the log file after which it is rotated"
+    log_backups_help = "Number of rotated log files kept"
+    pool_size_help = "Number of keep-alive connections to reddit, and of threads making the blocking calls"
+    connect_timeout_help = "Seconds to wait for a connection to reddit"
+    read_timeout_help = "Seconds to wait for each read of a response of reddit"
     parser.add_argument("--reddit",  help=reddit_help, action="store_true", required=False)
     parser.add_argument("--twitter",   help=twitter_help, action="store_true", required=False)
     parser.add_argument("--version", help=version_help, action="store_true", required=False)
+    parser.add_argument("--backfill", help=backfill_help, action="store_true", required=False)
+    parser.add_argument("--subreddits", help=subreddits_help, required=False)
+    parser.add_argument("--since", help=since_help, type=parse_timestamp, required=False)
+    parser.add_argument("--until", help=until_help, type=parse_timestamp, required=False)
+    parser.add_argument("--submissions", help=submissions_help, required=False)
+    parser.add_argument("--replace-more", help=replace_more_help, type=int, default=32, required=False)
+    parser.add_argument("--backfill-concurrency", help=backfill_concurrency_help, type=int, default=4,
+                        required=False)
+    parser.add_argument("--plan", help=plan_help, required=False)
+    parser.add_argument("--local", help=local_help, required=False)
+    parser.add_argument("--local-port", help=local_port_help, type=int, required=False)
     parser.add_argument("--verbose", action="store_true", required=False)
+    parser.add_argument("--consumers", help=consumers_help, type=int, required=False)
+    parser.add_argument("--workers", help=workers_help, type=int, required=False)
+    parser.add_argument("--accounts", help=accounts_help, required=False)
+    parser.add_argument("--metrics-port", help=metrics_port_help, type=int, required=False)
+    parser.add_argument("--metrics-file", help=metrics_file_help, required=False)
+    parser.add_argument("--async-logging", help=async_logging_help, action="store_true", required=False)
+    parser.add_argument("--log-max-bytes", help=log_max_bytes_help, type=int, default=131072, required=False)
+    parser.add_argument("--log-backups", help=log_backups_help, type=int, default=3, required=False)
+    parser.add_argument("--pool-size", help=pool_size_help, type=int, default=16, required=False)
+    parser.add_argument("--connect-timeout", help=connect_timeout_help, type=float, default=5.0, required=False)
+    parser.add_argument("--read-timeout", help=read_timeout_help, type=float, default=30.0, required=False)
     return parser
 
 
-def init_logger(fname='mc_bc_bot.log', level=logging.INFO, verbose=False):
+# Formats of the ISO dates accepted on the command line, each with or without a UTC offset
+ISO_DATE_FORMATS = ("%Y-%m-%d", "%Y-%m-%dT%H:%M", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M:%S.%f")
+
+
+def parse_timestamp(value):
+    """Returns the UNIX timestamp of an ISO date, a timestamp, or a number of hours ago such as 24h"""
+    if value.endswith("h"):
+        return time.time() - float(value[:-1]) * 3600
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    # Imported here, only the backfill needs it
+    import datetime
+    # fromisoformat and the colon of the offsets in %z need python 3.7, the deployment runs 3.6
+    iso_date = re.sub(r"([+-]\d{2}):?(\d{2})$", r"\1\2", value.strip().replace(" ", "T", 1).replace("Z", "+0000"))
+    for date_format in ISO_DATE_FORMATS:
+        for offset in ("%z", ""):
+            try:
+                moment = datetime.datetime.strptime(iso_date, date_format + offset)
+            except ValueError:
+                continue
+            if moment.tzinfo is None:
+                moment = moment.replace(tzinfo=datetime.timezone.utc)
+            return moment.timestamp()
+    raise argparse.ArgumentTypeError(f"{value} is no date, timestamp or number of hours")
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps only one in N of the high volume records, counted separately for every message template.
+    A record is sampled when it is logged with `extra={"sample_rate": N}`, or when its template is in `rates`
+
+    :param rates: dict of message template -> N, overriding the rate given by the call
+    """
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = rates or {}
+        self.counts = {}
+
+    def filter(self, record):
+        rate = self.rates.get(record.msg, getattr(record, "sample_rate", 1))
+        if rate <= 1:
+            return True
+        count = self.counts.get(record.msg, 0)
+        self.counts[record.msg] = count + 1
+        if count % rate:
+            return False
+        record.sampled = f" [1 in {rate}]"
+        return True
+
+
+class LazyQueueHandler(QueueHandler):
+    """Queues the records without formatting them. The message is only built by the listener thread,
+    so the arguments of the log calls must be cheap and safe to read from another thread.
+    Records are dropped when the queue is full rather than blocking the caller"""
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _SampledFormatter(logging.Formatter):
+    """Marks the records which were sampled by the SamplingFilter"""
+    def format(self, record):
+        if not hasattr(record, "sampled"):
+            record.sampled = ""
+        return super().format(record)
+
+
+_listener = None
+
+
+def init_logger(fname='mc_bc_bot.log', level=logging.INFO, verbose=False, asynchronous=False,
+                max_bytes=131072, backup_count=3, sample_rates=None, queue_size=10000):
     """ Init logger file where all output can be logged and classified
 
     :param fname: name of the log file
     :param level: level of the logger (?)
     :param verbose: True if print the logs on the screen
+    :param asynchronous: True if the records are written by a background thread instead of the caller
+    :param max_bytes: size of the log file after which it is rotated
+    :param backup_count: number of rotated log files kept
+    :param sample_rates: dict of message template -> N, only one in N of these records is logged
+    :param queue_size: maximum number of records waiting for the background thread
     :return:
         logger, the logger to use to print message on screen
     """
+    global _listener
     log_folder = pathlib.Path(__file__).parents[1] / "log_dir"
     if log_folder.exists() is False:
         log_folder.mkdir(parents=True, exist_ok=True)
 
     logging.basicConfig(level=level)
-    logger = logging.getLogger("mc_bc_bot")
-    for handler in logger.handlers:
+    # The modules log through loggers named after them, all children of the package logger
+    logger = logging.getLogger(__name__.rsplit(".utils", 1)[0])
+    logger.setLevel(level)
+    for handler in list(logger.handlers):
         logger.removeHandler(handler)
+    if _listener is not None:
+        _listener.stop()
+    handlers = [RotatingFileHandler(log_folder / fname, maxBytes=max_bytes, backupCount=backup_count)]
+    if verbose:
+        handlers.append(logging.StreamHandler(sys.stdout))
 
-    handler = RotatingFileHandler(log_folder / fname, maxBytes=131072, backupCount=3)
-
-    log_format = "%(levelname)s %(asctime)-15s %(threadName)s %(module)s %(lineno)i %(funcName)s %(message)s"
-    formatter = logging.Formatter(log_format, None)
-    handler.setLevel(level)
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
+    log_format = "%(levelname)s %(asctime)-15s %(threadName)s %(module)s %(lineno)i %(funcName)s %(message)s" \
+        "%(sampled)s"
+    formatter = _SampledFormatter(log_format, None)
+    for handler in handlers:
+        handler.setLevel(level)
+        handler.setFormatter(formatter)
 
-    if verbose:
-        stdout_handler = logging.StreamHandler(sys.stdout)
-        stdout_handler.setFormatter(formatter)
-        stdout_handler.setLevel(level)
-        logger.addHandler(stdout_handler)
+    if asynchronous:
+        queue_handler = LazyQueueHandler(queue.Queue(queue_size))
+        queue_handler.addFilter(SamplingFilter(sample_rates))
+        logger.addHandler(queue_handler)
+        _listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+    else:
+        # The records of the module loggers skip the filters of the package logger, every handler samples them.
+        # A shared filter would count every record once per handler
+        for handler in handlers:
+            handler.addFilter(SamplingFilter(sample_rates))
+            logger.addHandler(handler)
 
     # Prevent call forwarding to root logger
     logger.propagate = False
     return logger
 
 
+async def run_blocking(function, *args):
+    """Runs a blocking (network bound) call in the default executor so that the event loop stays free"""
+    # Imported here to keep asyncio out of the start-up of the modes which do not need it
+    import asyncio
+    return await asyncio.get_event_loop().run_in_executor(None, function, *args)
+
+
 def get_content_directory():
     """Returns the directory which contains all the content json files"""
     return pathlib.Path(__file__).parents[1] / "content"
+
+
+def _dependency_signature(path):
+    """Returns the modification time and the size of the file, None if it cannot be read"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class WatchedFile:
+    """Keeps the value loaded from a file and loads it again only when the file is modified.
+    If a modified file cannot be read or loaded, e.g. while an editor writes or replaces it, the previous value
+    is kept and the file is tried again at the next check
+
+    :param path: path of the file
+    :param loader: callable taking the path and returning the value
+    :param interval: minimum number of seconds between two checks of the modification time
+    :param dependencies: paths of other files read by the loader, which may be missing. The value is loaded again
+        when one of them is modified, created or deleted too
+    """
+    def __init__(self, path, loader, interval=1.0, dependencies=()):
+        self.path = path
+        self.loader = loader
+        self.interval = interval
+        self.dependencies = tuple(dependencies)
+        self.value = None
+        self.signature = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+    def get(self):
+        """Returns the loaded value, reloading it first if the file changed since the last load"""
+        now = time.monotonic()
+        if self.signature is not None and now - self.checked_at < self.interval:
+            return self.value
+        with self.lock:
+            self.checked_at = now
+            try:
+                stat = os.stat(self.path)
+            except OSError:
+                if self.signature is None:
+                    raise
+                logger.warning("Kept the previous content of %s, it cannot be read", self.path)
+                return self.value
+            signature = ((stat.st_mtime_ns, stat.st_size),) + tuple(map(_dependency_signature, self.dependencies))
+            if signature != self.signature:
+                try:
+                    value = self.loader(self.path)
+                except Exception:
+                    if self.signature is None:
+                        raise
+                    logger.exception("Kept the previous content of %s", self.path)
+                    return self.value
+                self.value = value
+                self.signature = signature
+        return self.value
+
+
+def get_artifacts_directory():
+    """Returns the directory in which the bot keeps the files it generates"""
+    return pathlib.Path(__file__).parents[1] / "artifacts"
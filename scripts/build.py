@@ -5,6 +5,10 @@ This contains sub-project entry point to build and release the package.
 
 
 """
+import argparse
+import codecs
+import hashlib
+import json
 import logging
 import os
 import sys
@@ -14,11 +18,13 @@ import subprocess
 import tempfile
 import shutil
 import re
+import threading
 import time
 if sys.version_info[0] >= 3:
     from urllib.request import urlretrieve
 else:
     from urllib import urlretrieve
+from collections import deque
 from contextlib import contextmanager
 from distutils.version import LooseVersion
 from distutils import dir_util
@@ -29,6 +35,22 @@ OUT_DIR = op.join(PKG_DIR, '__build_artifacts__')
 if not op.exists(OUT_DIR):
     os.makedirs(OUT_DIR)
 PROJECT_NAME = "mc_bc_bot"
+# The installers, the downloaded packages and the built environments, kept across the builds
+CACHE_DIR = op.join(OUT_DIR, 'cache')
+# Files whose content decides if a built environment can be reused, the conda one pins the python version
+REQUIREMENT_FILES = ('conda_requirements.txt', 'pip_requirements.txt')
+# Written in an environment once it was completely built
+ENVIRONMENT_MARKER = 'environment.json'
+# Number of built environments kept, so that reverting the requirements does not rebuild
+ENVIRONMENT_CACHE_SIZE = 2
+# Lines of a command output kept for its caller, from its start and from its end. All of them are logged
+OUTPUT_HEAD_LINES = 100
+OUTPUT_TAIL_LINES = 400
+# Bytes read at once from a command output, a longer line is logged in several parts
+OUTPUT_CHUNK_SIZE = 64 * 1024
+# The duration of every step of the last build, and of all the builds
+TIMINGS_FILE = op.join(OUT_DIR, 'build_timings.json')
+TIMINGS_HISTORY_FILE = op.join(OUT_DIR, 'build_timings.jsonl')
 
 
 logger = logging
@@ -66,9 +88,67 @@ class CondaError(RuntimeError):
     pass
 
 
+class BoundedOutput(object):
+    """The output of a command, keeping its first and its last lines only.
+
+    :param head:
+        int, number of lines kept from the start.
+
+    :param tail:
+        int, number of lines kept from the end.
+    """
+    def __init__(self, head=OUTPUT_HEAD_LINES, tail=OUTPUT_TAIL_LINES):
+        self.head_size = head
+        self.head = []
+        self.tail = deque(maxlen=tail)
+        self.skipped = 0
+
+    def append(self, line):
+        if len(self.head) < self.head_size:
+            self.head.append(line)
+            return
+        if len(self.tail) == self.tail.maxlen:
+            self.skipped += 1
+        self.tail.append(line)
+
+    def __str__(self):
+        lines = list(self.head)
+        if self.skipped:
+            lines.append("... {0} lines skipped ...\n".format(self.skipped))
+        lines.extend(self.tail)
+        return "".join(lines)
+
+
+def stream_output(pipe, output, prefix=""):
+    """Log the lines of a command output as they come and keep them in output.
+
+    The bytes are decoded as UTF-8, the invalid ones are replaced.
+
+    :param pipe:
+        file, the stdout or the stderr of the command.
+
+    :param output:
+        BoundedOutput, receiving the decoded lines.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    for chunk in iter(lambda: pipe.readline(OUTPUT_CHUNK_SIZE), b''):
+        line = decoder.decode(chunk)
+        if line:
+            output.append(line)
+            logger.info("{0}{1}".format(prefix, line.rstrip()))
+    line = decoder.decode(b'', final=True)
+    if line:
+        output.append(line)
+        logger.info("{0}{1}".format(prefix, line.rstrip()))
+    pipe.close()
+
+
 def run_command(command, command_inputs=None, cwd=None):
     """Simple wrapper around system command call.
 
+    The output of the command is logged line by line while it runs, only its
+    first and last lines are returned.
+
     :param command:
         str, the system command to execute.
 
@@ -76,6 +156,9 @@ def run_command(command, command_inputs=None, cwd=None):
         list, of the command input to send sequentially.
 
     :param cwd:
+        str, the directory in which the command is executed.
+
+    :return:
         (int, str, str), a tuple of error code, out string and error string
         outputs.
 
@@ -99,40 +182,144 @@ def run_command(command, command_inputs=None, cwd=None):
         executable=shell_executable
     )
 
-    out, err = ('', '')
-    if hasattr(command_inputs, '__iter__'):
-        for command_input in command_inputs:
-            if sys.version_info[0] >= 3:
-                command_input = command_input.encode('utf-8')
-            p_result = process.communicate(command_input)
-            if sys.version_info[0] >= 3:
-                p_result = [x.decode('ascii') for x in p_result]
-            out += p_result[0]
-            err += p_result[1]
-    else:
-        out, err = process.communicate('')
-        if sys.version_info[0] >= 3:
-            out = out.decode('ascii')
-            err = err.decode('ascii')
+    out, err = BoundedOutput(), BoundedOutput()
+    # Named after the caller, so that the logs tell which step the lines come from
+    name = threading.current_thread().name
+    readers = [threading.Thread(target=stream_output, name=name, args=(process.stdout, out)),
+               threading.Thread(target=stream_output, name=name, args=(process.stderr, err, "stderr: "))]
+    for reader in readers:
+        reader.daemon = True
+        reader.start()
+    try:
+        if hasattr(command_inputs, '__iter__'):
+            for command_input in command_inputs:
+                process.stdin.write(command_input.encode('utf-8'))
+                process.stdin.flush()
+        process.stdin.close()
+    except (IOError, OSError):
+        # The command exited without reading its inputs, its return code tells why
+        pass
+    for reader in readers:
+        reader.join()
+    process.wait()
 
-    return process.returncode, out, err
+    return process.returncode, str(out), str(err)
 
 
-def get_miniconda_from_web(archive_url, tmp_dir=None):
-    """Download miniconda archive from the web, return downloaded file."""
-    logger.info("Pull miniconda from {0} in {1}..."
-                .format(archive_url, tmp_dir))
+_timings = []
+_timings_lock = threading.Lock()
+
+
+@contextmanager
+def timed_step(name):
+    """Record the duration of a step of the build for the timing report."""
+    timing = {"step": name, "started_at": time.time(), "thread": threading.current_thread().name}
+    start = time.time()
+    try:
+        yield timing
+        timing["status"] = "ok"
+    except BaseException:
+        timing["status"] = "failed"
+        raise
+    finally:
+        timing["seconds"] = round(time.time() - start, 3)
+        with _timings_lock:
+            _timings.append(timing)
+        logger.info("Step {0} {1} in {2:0.2f} seconds".format(name, timing["status"], timing["seconds"]))
+
+
+def run_step(name, function, *args):
+    """Run a step of the build and record its duration."""
+    with timed_step(name):
+        return function(*args)
+
+
+def run_parallel(steps):
+    """Run independent steps of the build concurrently.
+
+    Every step runs in a thread named after it, so that the interleaved
+    logs tell which step they come from.
+
+    :param steps:
+        list, of (name, function, args) tuples.
+
+    :return:
+        list, the results of the steps in the same order.
+    """
+    results = [None] * len(steps)
+    errors = []
+
+    def run(index, name, function, args):
+        try:
+            results[index] = run_step(name, function, *args)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, name=name, args=(index, name, function, args))
+               for index, (name, function, args) in enumerate(steps)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+
+def write_timing_report(started_at, status, **details):
+    """Write the duration of every step recorded so far to TIMINGS_FILE.
+
+    The report is also appended to TIMINGS_HISTORY_FILE to follow the
+    duration of the deployments over time.
+
+    :param started_at:
+        float, the timestamp at which the build started.
+
+    :param status:
+        str, how the build ended, or "running" while the bot runs.
+    """
+    with _timings_lock:
+        steps = sorted(_timings, key=lambda timing: timing["started_at"])
+    report = dict(details, started_at=started_at, status=status,
+                  seconds=round(time.time() - started_at, 3), steps=steps)
+    with open(TIMINGS_FILE, 'w') as timings_file:
+        json.dump(report, timings_file, indent=2)
+    if status != "running":
+        with open(TIMINGS_HISTORY_FILE, 'a') as history_file:
+            history_file.write(json.dumps(report) + "\n")
+    logger.info("Timing report written to {0}".format(TIMINGS_FILE))
+    return report
+
+
+def get_miniconda_from_web(archive_url, tmp_dir=None, offline=False):
+    """Download miniconda archive from the web, return downloaded file.
+
+    The archive is named after its url, so that a cached one is reused until
+    the installer changes.
+
+    :param offline:
+        bool, only use an archive downloaded by a previous build.
+    """
     if tmp_dir is None:
         tmp_dir = tempfile.gettempdir()
-    if platform.system() == "Windows":
-        tmp_file = op.join(tmp_dir, "miniconda_install.exe")
-    else:
-        tmp_file = op.join(tmp_dir, "miniconda_install.sh")
+    tmp_file = op.join(tmp_dir, archive_url.rsplit('/', 1)[-1])
 
-    if not op.exists(tmp_file):
-        urlretrieve(archive_url, tmp_file)
-        if not op.exists(tmp_file):
-            raise CondaError("Could not download {0}".format(archive_url))
+    if op.exists(tmp_file):
+        logger.info("Using the miniconda installer cached in {0}".format(tmp_file))
+        return tmp_file
+    if offline:
+        raise CondaError("No miniconda installer is cached in {0}, it cannot "
+                         "be downloaded offline".format(tmp_dir))
+
+    logger.info("Pull miniconda from {0} in {1}..."
+                .format(archive_url, tmp_dir))
+    if not op.exists(tmp_dir):
+        os.makedirs(tmp_dir)
+    # Downloaded aside, an interrupted download is not mistaken for the installer
+    urlretrieve(archive_url, tmp_file + '.part')
+    if not op.exists(tmp_file + '.part'):
+        raise CondaError("Could not download {0}".format(archive_url))
+    os.rename(tmp_file + '.part', tmp_file)
 
     return tmp_file
 
@@ -211,11 +398,14 @@ def install_conda_command():
                          "{2}".format(out, err, code))
 
 
-def create_or_update_root_environment(environment_settings, location):
+def create_or_update_root_environment(environment_settings, location, offline=False):
     """Ensure we get a distribution from which we can create environments.
 
     :param environment_settings:
         dict, containing the list of necessary module statuses.
+
+    :param offline:
+        bool, only use the installer cached by a previous build.
     """
     # if not environment_settings["conda"]:
     #     if not environment_settings["pip"]:
@@ -223,25 +413,34 @@ def create_or_update_root_environment(environment_settings, location):
     # Then we need a basic installation
     logger.info("Root environment is missing conda and pip.")
 
+    file_archive = get_miniconda_installer(offline)
     if platform.system() == "Windows":
-        file_archive = get_miniconda_from_web(
-            archive_url=CONDA_INSTALLER['windows'], tmp_dir=location
-        )
-
         root_interpreter_path = install_miniconda_windows(
             file_archive=file_archive, location=location
         )
     else:
-        file_archive = get_miniconda_from_web(
-            archive_url=CONDA_INSTALLER['linux'], tmp_dir=location
-        )
-
         root_interpreter_path = install_miniconda_linux(
             file_archive=file_archive, location=location
         )
     return root_interpreter_path
 
 
+def get_miniconda_installer(offline=False):
+    """Return the miniconda installer of the platform, downloaded once in the cache.
+
+    :param offline:
+        bool, only use the installer cached by a previous build.
+    """
+    installer_dir = op.join(CACHE_DIR, 'installers')
+    if platform.system() == "Windows":
+        archive_url = CONDA_INSTALLER['windows']
+    else:
+        archive_url = CONDA_INSTALLER['linux']
+    return get_miniconda_from_web(
+        archive_url=archive_url, tmp_dir=installer_dir, offline=offline
+    )
+
+
 def get_python_bin_from_env(env_prefix):
     """Return the platform independent location of the python executable.
 
@@ -281,29 +480,45 @@ def run_python(env_prefix, args, cwd=None):
     return run_command(command, cwd=cwd)
 
 
-def install_pip_dependencies(python_prefix):
+def install_pip_dependencies(python_prefix, wheel_dir=None, offline=False):
     """ Install pip dependencies.
 
     In some case the package dependencies are only available through pip. In
     such case this function enables the user to install the pip dependencies in
     the corresponding python environment pointed by python_prefix.
 
+    The packages are downloaded in wheel_dir first and installed from there
+    only, so that the next builds can install them without any network.
+
     :param python_prefix:
         The root folder of the python environment to use.
 
+    :param wheel_dir:
+        str, the folder of the downloaded packages.
+
+    :param offline:
+        bool, install from the packages of wheel_dir without downloading any.
+
     """
     pip_req_dir = op.join(THIS_DIR)
 
     pip_req_file = op.join(pip_req_dir, 'pip_requirements.txt')
+    if wheel_dir is None:
+        wheel_dir = op.join(CACHE_DIR, 'wheels')
 
 
     if op.exists(pip_req_file):
+        if not offline:
+            logger.info("Downloading the pip dependencies in {0} ...".format(wheel_dir))
+            code, out, err = run_step("pip_download", run_python, python_prefix, '-m pip download -r {0} -d "{1}"'
+                                      .format(pip_req_file, wheel_dir))
+            if code != 0:
+                raise CondaError("Could not download some dependencies")
         logger.info("Installing additional dependencies through pip ...")
-        code, out, err = run_python(python_prefix, "-m pip install -r {0}"
-                                    .format(pip_req_file))
-        logger.info(out)
+        code, out, err = run_step("pip_install", run_python, python_prefix,
+                                  '-m pip install --no-index --find-links "{0}" -r {1}'
+                                  .format(wheel_dir, pip_req_file))
         if code != 0:
-            logger.error(err)
             raise CondaError("Could not install some dependencies")
 
 
@@ -322,14 +537,12 @@ def run_local_env_command(python_prefix, command, cwd=THIS_DIR):
         python_exec = op.join(python_prefix, "bin", "python")
         localized_command = "{0} -m {1}".format(python_exec, command)
     code, out, err = run_command(localized_command, cwd=cwd)
-    logger.info(out)
     if 'error' in err or code != 0:
-        logger.error(err)
         raise CondaError("Command {0} returned error code {1}, error: {2}"
                          .format(command, code, err))
 
 
-def make_conda_env(python_prefix):
+def make_conda_env(python_prefix, offline=False):
     """Create a conda environment based on package definition.
 
     Since conda does not support creating environment based on package
@@ -341,6 +554,9 @@ def make_conda_env(python_prefix):
     :param python_prefix:
         The path where to create the python environment.
 
+    :param offline:
+        bool, only install the packages cached by a previous build.
+
     """
 
     requirement_file = "conda_requirements.txt"
@@ -352,10 +568,13 @@ def make_conda_env(python_prefix):
 
     command = "conda install --file {0} -p {1} -y"\
         .format(conda_req_file, python_prefix)
-    run_local_env_command(python_prefix, command)
+    if offline:
+        command += " --offline"
+    run_step("conda_install", run_local_env_command, python_prefix, command)
 
-    # Install pip dependencies after conda requirements.
-    install_pip_dependencies(python_prefix)
+    # Install pip dependencies after conda requirements, which may replace
+    # the python they are downloaded for.
+    install_pip_dependencies(python_prefix, offline=offline)
 
     return python_prefix
 
@@ -397,34 +616,105 @@ def check_conda():
 
 
 def get_environment_settings():
-    """Return a dict condaining the status of different packages needed."""
-    env = {
-        "pip": check_pip(),
-        "pipenv": check_pipenv(),
-        "conda": check_conda()
-    }
+    """Return a dict condaining the status of different packages needed.
+
+    The checks are independent and run concurrently.
+    """
+    checks = {"pip": check_pip, "pipenv": check_pipenv, "conda": check_conda}
+    results = run_parallel([("check_" + name, check, ()) for name, check in checks.items()])
+    env = dict(zip(checks, results))
     logger.debug("Current python env: {0}".format(env))
     return env
 
 
+def environment_key():
+    """Return the key of the environment built from the current requirements.
+
+    It hashes the requirement files, the pinned python version included, the
+    installer and the platform, so that an environment is rebuilt only when
+    one of them changed.
+
+    :return:
+        str, the hex digest of the requirements.
+    """
+    digest = hashlib.sha256()
+    for requirement_file in REQUIREMENT_FILES:
+        digest.update(requirement_file.encode('utf-8'))
+        path = op.join(THIS_DIR, requirement_file)
+        if op.exists(path):
+            with open(path, 'rb') as requirements:
+                digest.update(requirements.read())
+    installer = CONDA_INSTALLER['windows' if platform.system() == "Windows" else 'linux']
+    digest.update("{0} {1} {2}".format(installer, platform.system(), platform.machine()).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def get_environment_prefix(env_dir):
+    """Return the python prefix installed in the environment folder."""
+    if platform.system() == "Windows":
+        return op.join(env_dir, 'build_env_windows')
+    return op.join(env_dir, 'build_env_linux')
+
+
+def is_environment_built(env_dir, key):
+    """Return True if the environment folder was completely built for the key."""
+    marker = op.join(env_dir, ENVIRONMENT_MARKER)
+    if not op.exists(marker):
+        return False
+    with open(marker) as marker_file:
+        return json.load(marker_file).get('key') == key
+
+
+def mark_environment_built(env_dir, key):
+    """Record that the environment folder was completely built for the key."""
+    with open(op.join(env_dir, ENVIRONMENT_MARKER), 'w') as marker_file:
+        json.dump({'key': key, 'built_at': time.time(),
+                   'requirements': list(REQUIREMENT_FILES)}, marker_file)
+
+
+def prune_environments(env_root, keep):
+    """Delete the least recently used environments beyond ENVIRONMENT_CACHE_SIZE.
+
+    :param keep:
+        str, the folder of the environment in use, never deleted.
+    """
+    env_dirs = [op.join(env_root, name) for name in os.listdir(env_root)]
+    env_dirs = sorted((env_dir for env_dir in env_dirs if env_dir != keep),
+                      key=op.getmtime, reverse=True)
+    for env_dir in env_dirs[ENVIRONMENT_CACHE_SIZE - 1:]:
+        logger.info("Deleting the unused environment {0}".format(env_dir))
+        shutil.rmtree(env_dir, ignore_errors=True)
+
+
 @contextmanager
-def conda_env():
-    """ Create a temporary python environment to run the packaging.
+def conda_env(offline=False, rebuild=False):
+    """ Provide the python environment to run the packaging.
+
+    This context manager will provide a safe wrapper around the python
+    distribution. The distribution is built based on package requirements and
+    cached under the key of those requirements, so that the next builds reuse
+    it until the requirements change. An environment whose build was
+    interrupted is built again.
+
+    :param offline:
+        bool, build the environment from the installer and the packages
+        cached by the previous builds, without any network.
 
-    This context manager will provide a safe wrapper around the temporary
-    python distribution. The python distribution is built every time based on
-    package requirements and disposed (folder deleted) on exit.
+    :param rebuild:
+        bool, build the environment again even if it is cached.
 
     :return:
-        tmp_conda the path to the temporary python environment.
+        the path to the python environment.
     """
-    tmp_conda = op.join(OUT_DIR, '_tmp_conda_env_3')
-    logger.info("Temporary python environment will be located in : {0}"
-                .format(tmp_conda))
+    key = environment_key()
+    env_root = op.join(CACHE_DIR, 'envs')
+    env_dir = op.join(env_root, key[:16])
+    logger.info("Python environment will be located in : {0}"
+                .format(env_dir))
 
     original_environ = os.environ.copy()
     if platform.system() == "Windows":
-        path_to_add = op.join(tmp_conda, 'build_env_windows', 'Library', 'bin')
+        path_to_add = op.join(env_dir, 'build_env_windows', 'Library', 'bin')
         if 'PATH' in original_environ.keys():
             original_path = original_environ['PATH']
             os.environ['PATH'] = path_to_add + os.pathsep + original_path
@@ -433,30 +723,37 @@ def conda_env():
 
     # Required for unittests with the CLI which are spawned in a new shell
     os.environ['PYTHONPATH'] = op.join(OUT_DIR, '..')
+    # Shared by the environments, so that a rebuild does not download the packages again
+    os.environ['CONDA_PKGS_DIRS'] = op.join(CACHE_DIR, 'conda_pkgs')
 
     try:
-        if not op.exists(tmp_conda):
-            os.makedirs(tmp_conda)
-            env_settings = get_environment_settings()
-            root_interpreter_path = create_or_update_root_environment(
-                env_settings, tmp_conda
-            )
-
+        if not rebuild and is_environment_built(env_dir, key):
+            logger.info("Reusing the environment built for the same requirements")
+            # Its modification time tells which environments were used last
+            os.utime(env_dir, None)
+            yield get_environment_prefix(env_dir)
+        else:
+            if op.exists(env_dir):
+                logger.warning("Deleting the environment {0} to build it again".format(env_dir))
+                shutil.rmtree(env_dir)
+            os.makedirs(env_dir)
             try:
-                yield make_conda_env(root_interpreter_path)
+                # The installer is downloaded while the interpreter is checked
+                env_settings, _ = run_parallel([
+                    ("environment_settings", get_environment_settings, ()),
+                    ("miniconda_installer", get_miniconda_installer, (offline,))
+                ])
+                root_interpreter_path = run_step(
+                    "root_environment", create_or_update_root_environment, env_settings, env_dir, offline
+                )
+                python_prefix = make_conda_env(root_interpreter_path, offline)
             except CondaError as e:
                 logger.error("Could not setup conda env. Reason: {0}. Aborting."
                              .format(e.args[0]))
-        else:
-            # If it exists we assume the env is ok
-            logger.warning(
-                "A local environment exists already! We will assume it is correct."
-            )
-            logger.warning("Skipping create_or_update_root_environment")
-            if platform.system() == "Windows":
-                yield op.join(tmp_conda, 'build_env_windows')
-            else:
-                yield op.join(tmp_conda, 'build_env_linux')
+                raise
+            mark_environment_built(env_dir, key)
+            prune_environments(env_root, env_dir)
+            yield python_prefix
     finally:
         os.environ = original_environ
 
@@ -475,19 +772,22 @@ def run_tests(python_prefix):
     # command = "{0} run {1} test 2>&1".format(coverage_exec, setup_file)
     command = "{0} run --source={1}/project_dir {2} test 2>&1".format(coverage_exec, PKG_DIR, setup_file)
     logger.info("Test command : {0}".format(command))
-    run_local_env_command(python_prefix, command, cwd=PKG_DIR)
+    run_step("tests", run_local_env_command, python_prefix, command, PKG_DIR)
 
-    # Reporting
-    command = "{0} report -m".format(coverage_exec)
-    run_local_env_command(python_prefix, command, cwd=PKG_DIR)
+    # The reports only read the coverage data, they are built concurrently
+    reports = [
+        ("coverage_report", "{0} report -m".format(coverage_exec)),
+        ("coverage_html", "{0} html -d {1}".format(coverage_exec, op.join(OUT_DIR, "test_report"))),
+        ("coverage_xml", "{0} xml -o {1}".format(coverage_exec, op.join(OUT_DIR, "coverage.xml")))
+    ]
+    run_parallel([(name, run_local_env_command, (python_prefix, command, PKG_DIR)) for name, command in reports])
 
-    # Build html report
-    command = "{0} html -d {1}".format(coverage_exec, op.join(OUT_DIR, "test_report"))
-    run_local_env_command(python_prefix, command, cwd=PKG_DIR)
 
-    # Build XML report
-    command = "{0} xml -o {1}".format(coverage_exec, op.join(OUT_DIR, "coverage.xml"))
-    run_local_env_command(python_prefix, command, cwd=PKG_DIR)
+def compile_sledges(python_prefix):
+    """Compile the sledges.json into the memory-mapped corpus read by the bot"""
+    code, out, err = run_python(python_prefix, op.join(THIS_DIR, "compile_sledges.py"), cwd=PKG_DIR)
+    if code != 0:
+        raise RuntimeError("Could not compile the sledges")
 
 
 def execute_bot(python_prefix):
@@ -515,17 +815,39 @@ def do_cleanup(python_prefix):
         raise RuntimeError("setup.py clean failed to run!")
 
 
-def main():
-    with conda_env() as env_prefix:
-        logger.info("Using python environment: {0}".format(env_prefix))
-        try:
-            # run_tests(env_prefix)
-            execute_bot(env_prefix)
-            return 0
-        except Exception as e:
-            logger.error("At least one error occurred during building.")
-            logger.error("Error : {0}".format(e))
-            return 1
+def parse_arguments(args=None):
+    """Parse the command line of the builder."""
+    parser = argparse.ArgumentParser(description="Build the environment of the bot and run it")
+    parser.add_argument("--offline", action="store_true",
+                        help="Build the environment from the installer and the packages cached by a previous build")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="Build the environment again even if the requirements did not change")
+    return parser.parse_args(args)
+
+
+def main(offline=False, rebuild=False):
+    started_at = time.time()
+    status = "failed"
+    try:
+        with conda_env(offline, rebuild) as env_prefix:
+            logger.info("Using python environment: {0}".format(env_prefix))
+            try:
+                # run_tests(env_prefix)
+                run_step("compile_sledges", compile_sledges, env_prefix)
+                # The deployment is done once the bot starts, which runs until it is stopped
+                write_timing_report(started_at, "running", offline=offline, rebuild=rebuild)
+                run_step("execute_bot", execute_bot, env_prefix)
+                status = "ok"
+                return 0
+            except Exception as e:
+                logger.error("At least one error occurred during building.")
+                logger.error("Error : {0}".format(e))
+                return 1
+    except CondaError:
+        # Already logged by conda_env
+        return 1
+    finally:
+        write_timing_report(started_at, status, offline=offline, rebuild=rebuild)
 
 
 def configure_logging():
@@ -547,4 +869,5 @@ def configure_logging():
 if __name__ == '__main__':
     define_display()
     logger = configure_logging()
-    sys.exit(main())
+    arguments = parse_arguments()
+    sys.exit(main(offline=arguments.offline, rebuild=arguments.rebuild))
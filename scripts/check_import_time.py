@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Import-time budget check of the CLI.
+
+Runs `mc_bc_bot.py --version` under `python -X importtime` and fails when the
+cumulative import time goes over the budget, or when any of the network
+modules is imported at all. The supervisor restarts and health probes call the
+CLI often, they should not pay for praw.
+
+    python scripts/check_import_time.py --budget-ms 150
+"""
+import argparse
+import os
+import os.path as op
+import subprocess
+import sys
+
+THIS_DIR = op.abspath(op.dirname(__file__))
+PKG_DIR = op.abspath(op.join(THIS_DIR, os.pardir))
+ENTRY_POINT = op.join(PKG_DIR, "project_dir", "mc_bc_bot", "mc_bc_bot.py")
+
+# Milliseconds of imports allowed for --version
+DEFAULT_BUDGET_MS = 150
+# Modules which must not be imported by --version
+FORBIDDEN_MODULES = ("praw", "prawcore", "requests", "cachetools", "asyncio")
+
+
+def measure_imports(args=("--version",), python=sys.executable):
+    """Returns a dict of the top level modules imported by the CLI and their cumulative import time in us,
+    and the set of the names of all the modules it imported, directly or not"""
+    environment = dict(os.environ, PYTHONPATH=PKG_DIR)
+    process = subprocess.run([python, "-X", "importtime", ENTRY_POINT] + list(args),
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=environment, cwd=PKG_DIR,
+                             universal_newlines=True)
+    if process.returncode != 0:
+        raise RuntimeError("The CLI failed: {0}".format(process.stderr))
+    imports = {}
+    modules = set()
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.add(name.strip())
+        # Only the modules imported directly by the program count, their children are in their cumulative time
+        if not name[1:].startswith(" "):
+            imports[name.strip()] = int(cumulative)
+    return imports, modules
+
+
+def check(budget_ms=DEFAULT_BUDGET_MS, repeat=3):
+    """Returns the list of the violations of the budget, empty if the CLI starts fast enough"""
+    # The fastest of a few runs, the first one may include a cold disk cache
+    runs = [measure_imports() for _ in range(repeat)]
+    imports = min((imports for imports, _ in runs), key=lambda run: sum(run.values()))
+    total_ms = sum(imports.values()) / 1000
+    print("--version imported {0} top level modules in {1:.1f} ms (budget {2} ms)"
+          .format(len(imports), total_ms, budget_ms))
+    violations = []
+    if total_ms > budget_ms:
+        slowest = sorted(imports.items(), key=lambda item: -item[1])[:5]
+        violations.append("Import time {0:.1f} ms is over the budget, slowest: {1}".format(
+            total_ms, ", ".join("{0} {1:.1f} ms".format(name, us / 1000) for name, us in slowest)))
+    # The network modules are usually imported indirectly, through a module of the bot
+    for _, modules in runs:
+        for name in modules:
+            if name.split(".")[0] in FORBIDDEN_MODULES:
+                violations.append("{0} must not be imported by --version".format(name))
+    return sorted(set(violations))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fails if the start-up of the CLI gets slow")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    arguments = parser.parse_args()
+    violations = check(arguments.budget_ms)
+    for violation in violations:
+        print(violation)
+    return 1 if violations else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
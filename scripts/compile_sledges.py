@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""Compiles the sledges.json into the memory-mapped corpus of the bot.
+
+The bot maps the compiled corpus instead of parsing the json as long as it is
+at least as recent as the json, so it must be compiled again after editing it.
+
+    python scripts/compile_sledges.py [--source sledges.json] [--output sledges.bin]
+"""
+import argparse
+import os
+import os.path as op
+import sys
+
+THIS_DIR = op.abspath(op.dirname(__file__))
+PKG_DIR = op.abspath(op.join(THIS_DIR, os.pardir))
+sys.path.insert(0, PKG_DIR)
+
+from project_dir.mc_bc_bot.utils.general_utilities import get_content_directory  # noqa: E402
+from project_dir.mc_bc_bot.core.sledges import SledgeCorpus, MappedSledgeCorpus, compile_corpus, \
+    get_compiled_corpus_path  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compiles the sledges.json into the memory-mapped corpus")
+    parser.add_argument("--source", default=str(get_content_directory() / "sledges.json"))
+    parser.add_argument("--output", default=str(get_compiled_corpus_path()))
+    arguments = parser.parse_args()
+
+    corpus = SledgeCorpus.from_json_file(arguments.source)
+    os.makedirs(op.dirname(op.abspath(arguments.output)), exist_ok=True)
+    compile_corpus(corpus, arguments.output)
+    compiled = MappedSledgeCorpus(arguments.output)
+    if compiled.to_dict() != corpus.to_dict():
+        print("The compiled corpus differs from {0}".format(arguments.source))
+        return 1
+    print("Compiled {0} sledges into {1} ({2} bytes)".format(len(compiled), arguments.output,
+                                                            op.getsize(arguments.output)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())